@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# _njit.py — опциональный numba.
+# Если numba не установлена, njit становится декоратором-заглушкой
+# и ядра выполняются как обычный Python.
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Заглушка для @njit и @njit(...): возвращает функцию без изменений."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+    prange = range
+
+__all__ = ["njit", "prange", "NUMBA_AVAILABLE"]
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# build_numba_aot.py — AOT-сборка numba-ядер strategy_levels в модуль cryptolite_kernels.
+# Запуск: python build_numba_aot.py (нужна numba с numba.pycc).
+# Результат (cryptolite_kernels*.so/.pyd) кладётся рядом со скриптом и
+# подхватывается strategy_levels при импорте; без него работают @njit(cache=True).
+
+import os, sys
+
+try:
+    from numba.pycc import CC
+except ImportError:
+    print("ERROR: numba.pycc недоступен — установите numba (версию с поддержкой pycc)")
+    sys.exit(1)
+
+import strategy_levels as st
+
+OUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+cc = CC("cryptolite_kernels")
+cc.output_dir = OUT_DIR
+cc.verbose = True
+
+for name, (kernel, signature) in st._JIT_KERNELS.items():
+    # py_func — исходная Python-функция за диспетчером @njit
+    cc.export(name, signature)(getattr(kernel, "py_func", kernel))
+    print(f"export {name}: {signature}")
+
+cc.compile()
+print(f"✅ cryptolite_kernels собран в {OUT_DIR}")
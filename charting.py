@@ -2,6 +2,7 @@
 import matplotlib
 matplotlib.use("Agg")
 
+import io
 import matplotlib.pyplot as plt
 from typing import List, Dict, Any, Optional
 import numpy as np
@@ -337,4 +338,16 @@ def plot_png(
                edgecolor='none', bbox_inches='tight')
     plt.close(fig)
 
-    return out_path
\ No newline at end of file
+    return out_path
+
+
+def plot_png_bytes(
+    candles: List[Dict[str, Any]],
+    levels: Dict[str, float],
+    title: str = "",
+    lr_info: Optional[Dict] = None,
+) -> bytes:
+    """То же, что plot_png, но PNG возвращается байтами (без файла на диске)."""
+    buf = io.BytesIO()
+    plot_png(candles, levels, buf, title=title, lr_info=lr_info)
+    return buf.getvalue()
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import os, asyncio, logging, time, sys
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any
+import os, asyncio, logging, multiprocessing, time, sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import count, islice
+from typing import Awaitable, Dict, List, Optional, Tuple, Any
 
 from dotenv import load_dotenv
 import aiohttp
+import numpy as np
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -32,6 +35,7 @@ logging.basicConfig(
         logging.FileHandler("bot.log", encoding="utf-8")
     ]
 )
+logger = logging.getLogger(__name__)
 
 # Теперь импортируем остальные модули
 try:
@@ -40,12 +44,14 @@ try:
         pick_biggest_candle,
         calculate_rsi,
         calculate_all_emas,
+        wilder_averages,
+        wilder_step,
         ema_trend_analysis,
         detect_patterns,
         calculate_levels_for_candle
     )
-    from charting import plot_png
-    from tg import TelegramBot
+    from charting import plot_png_bytes
+    from tg import TelegramBot, close_session as close_tg_session
     from trend_detector import analyze_trend
     from futures_bybit import fetch_kline
     
@@ -53,19 +59,22 @@ try:
     try:
         from margin_zone_engine import find_margin_zones
         MARGINZONE_AVAILABLE = True
-        logging.info("✅ MarginZone модули загружены")
+        logger.info("✅ MarginZone модули загружены")
     except ImportError as e:
-        logging.warning(f"MarginZone модули не доступны: {e}")
+        logger.warning("MarginZone модули не доступны: %s", e)
         MARGINZONE_AVAILABLE = False
         
 except ImportError as e:
-    logging.error(f"❌ Ошибка импорта модулей: {e}")
-    import traceback
-    logging.error(traceback.format_exc())
+    logger.exception("❌ Ошибка импорта модулей: %s", e)
     sys.exit(1)
 
-OUT_DIR = str(Path("out").resolve())
-Path(OUT_DIR).mkdir(parents=True, exist_ok=True)
+# Уникальный номер графика в процессе (секундный time.time() давал коллизии)
+_img_seq = count()
+
+# Отрисовка matplotlib — CPU-bound, выносим в отдельные процессы,
+# чтобы не блокировать event loop (backend Agg задаётся в charting.py).
+# Пул создаётся в main_loop и закрывается при выходе из него
+_plot_pool: Optional[ProcessPoolExecutor] = None
 
 # ============================================================================
 # КОНФИГУРАЦИЯ СИСТЕМЫ
@@ -83,8 +92,16 @@ SYMBOLS_TFS = {
     "INJUSDT": ["15m", "1h"],
 }
 
+# Сколько пар (символ, ТФ) обрабатывается одновременно за итерацию основного цикла
+MAX_CONCURRENT_PAIRS = 8
+
 TF_MIN = {"5m": 5, "15m": 15, "1h": 60, "4h": 240}
 
+# Производные таблицы по ТФ (считаются один раз при импорте)
+_BARS_24H = {tf: max(1, (24 * 60) // m) for tf, m in TF_MIN.items()}
+_TF_MS = {tf: m * 60_000 for tf, m in TF_MIN.items()}
+_DAYS_RU = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
 # Параметры для маржинальных зон
 ZONES_ATR_MULTIPLIER = 1.8
 ZONES_CONSOLIDATION_BARS = 5
@@ -97,8 +114,8 @@ COLLISION_THRESHOLD_PERCENT = 0.105  # Порог совпадения 0.105%
 
 # Состояния для уровней, зон и совпадений
 _last_state: Dict[str, str] = {}
-_last_zones_state: Dict[str, str] = {}
-_last_collisions_state: Dict[str, str] = {}
+_last_zones_state: Dict[str, Tuple] = {}
+_last_collisions_state: Dict[str, Tuple] = {}
 _last_sent_candle_ts: Dict[str, int] = {}
 _last_price: Dict[str, float] = {}
 _last_banner_ts: float = 0.0
@@ -109,10 +126,18 @@ _break_latched: Dict[str, bool] = {}
 _latched_on_ts: Dict[str, int] = {}
 _wait_new_candle: Dict[str, bool] = {}
 
-# Для отслеживания пробоев
+# Для отслеживания пробоев (монотонные мс, см. _now_ms)
 _last_breakout_time: Dict[str, int] = {}
+_COOLDOWN_MS = 5 * 60 * 1000
 _current_levels: Dict[str, Dict[str, float]] = {}
 
+# EMA/RSI на последней ЗАКРЫТОЙ свече (candles[-2]) для окна (длина, ts первой, ts закрытой)
+_ema_state: Dict[str, Tuple[Tuple[int, int, int], Dict[str, float]]] = {}     # key -> (окно, EMA_p -> ema)
+_rsi_state: Dict[str, Tuple[Tuple[int, int, int], float, float]] = {}         # key -> (окно, avg_gain, avg_loss)
+
+# SoA-представление свечей по ключу: ((len, first_ts, last_ts), (ts, open, high, low, close, volume))
+_soa_cache: Dict[str, Tuple[Tuple[int, int, int], Tuple[np.ndarray, ...]]] = {}
+
 # Для хранения уровней, зон и совпадений
 _levels_data: Dict[str, List[float]] = {}
 _zones_data: Dict[str, List[Dict]] = {}
@@ -122,6 +147,10 @@ _collisions_data: Dict[str, List[Dict]] = {}
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
+def _now_ms() -> int:
+    """Монотонное время в мс — не прыгает при коррекции системных часов (NTP)."""
+    return time.monotonic_ns() // 1_000_000
+
 def _key(symbol: str, tf: str) -> str:
     return f"{symbol}|{tf}"
 
@@ -134,68 +163,65 @@ def _state_signature(levels: Dict[str, float]) -> str:
         for k in ("X", "A", "C", "D", "F", "Y")
     ) + f"|base={levels.get('_base_ts', 0)}"
 
-def _zones_signature(zones: List[Dict]) -> str:
-    """Создает уникальную сигнатуру для маржинальных зон."""
-    if not zones:
-        return "no_zones"
-    return "|".join(
-        f"{zone.get('low', 0):.8f}-{zone.get('high', 0):.8f}"
-        for zone in zones[:5]  # Берем первые 5 зон
+def _zones_signature(zones: List[Dict]) -> Tuple:
+    """Создает уникальную сигнатуру для маржинальных зон (первые 5 зон)."""
+    return tuple(
+        (round(zone.get('low', 0), 8), round(zone.get('high', 0), 8))
+        for zone in islice(zones, 5)
     )
 
-def _collisions_signature(collisions: List[Dict]) -> str:
-    """Создает уникальную сигнатуру для совпадений."""
-    if not collisions:
-        return "no_collisions"
-    return "|".join(
-        f"{collision.get('level', 0):.8f}-{collision.get('zone_low', 0):.8f}-{collision.get('zone_high', 0):.8f}"
-        for collision in collisions[:5]  # Берем первые 5 совпадений
+def _collisions_signature(collisions: List[Dict]) -> Tuple:
+    """Создает уникальную сигнатуру для совпадений (первые 5 совпадений)."""
+    # Словари совпадений строит check_collisions — ключи всегда на месте
+    return tuple(
+        (
+            round(collision['level'], 8),
+            round(collision['zone_low'], 8),
+            round(collision['zone_high'], 8),
+        )
+        for collision in islice(collisions, 5)
     )
 
 def _bars_24h(tf: str) -> int:
     """Количество баров за 24 часа для данного ТФ."""
-    return max(1, (24 * 60) // TF_MIN.get(tf, 5))
+    return _BARS_24H.get(tf, 288)
 
+@lru_cache(maxsize=4096)
 def _ts_to_human_str(ts_ms: int) -> str:
     """Преобразует timestamp в читаемое время с указанием дня недели на русском."""
     if ts_ms <= 0:
         return "N/A"
     
     t = time.localtime(ts_ms // 1000)
-    days_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-    day_of_week = days_ru[t.tm_wday]
+    day_of_week = _DAYS_RU[t.tm_wday]
     
     return time.strftime(f"%d.%m.%Y {day_of_week} %H:%M", t)
 
-def _get_candle_time_range(candle: Dict, tf: str) -> Tuple[str, str]:
-    """Возвращает время открытия и закрытия свечи."""
-    ts_ms = int(candle.get("ts", 0))
+@lru_cache(maxsize=4096)
+def _candle_time_range_ms(ts_ms: int, tf: str) -> Tuple[str, str]:
+    """Кэшируемая часть _get_candle_time_range (ключ — ts и ТФ)."""
     if ts_ms <= 0:
         return "N/A", "N/A"
     
     open_time = _ts_to_human_str(ts_ms)
-    
-    tf_duration_ms = {
-        "5m": 5 * 60 * 1000,
-        "15m": 15 * 60 * 1000,
-        "1h": 60 * 60 * 1000,
-        "4h": 4 * 60 * 60 * 1000
-    }
-    
-    close_ts = ts_ms + tf_duration_ms.get(tf, 60 * 60 * 1000)
+    close_ts = ts_ms + _TF_MS.get(tf, 3_600_000)
     close_time = _ts_to_human_str(close_ts)
     
     return open_time, close_time
 
+def _get_candle_time_range(candle: Dict, tf: str) -> Tuple[str, str]:
+    """Возвращает время открытия и закрытия свечи."""
+    return _candle_time_range_ms(int(candle.get("ts", 0)), tf)
+
+_RSI_TAGS = ("🟢", "🟡", "🔴")
+_EMA_ARROWS = ("▼", "●", "▲")
+
 def _rsi_tag(rsi: Optional[float]) -> str:
     """Форматирует RSI с эмодзи."""
     if rsi is None:
         return "—"
-    if rsi >= 70:
-        return f"{rsi:.1f} 🔴"
-    if rsi <= 30:
-        return f"{rsi:.1f} 🟢"
-    return f"{rsi:.1f} 🟡"
+    # <=30 → 0, (30;70) → 1, >=70 → 2
+    return f"{rsi:.1f} {_RSI_TAGS[(rsi > 30) + (rsi >= 70)]}"
 
 def _format_ema_value(price: float, ema_value: Optional[float]) -> str:
     """Форматирует значение EMA с указанием положения цены."""
@@ -203,14 +229,26 @@ def _format_ema_value(price: float, ema_value: Optional[float]) -> str:
         return "—"
     
     diff = price - ema_value
-    diff_percent = (diff / ema_value * 100) if ema_value != 0 else 0
-    
-    if diff > 0:
-        return f"{ema_value:.6f} ▲ (+{abs(diff_percent):.2f}%)"
-    elif diff < 0:
-        return f"{ema_value:.6f} ▼ ({diff_percent:.2f}%)"
-    else:
+    sign = (diff > 0) - (diff < 0)
+    if not sign:
         return f"{ema_value:.6f} ● (0.00%)"
+    
+    diff_percent = (diff / ema_value * 100) if ema_value != 0 else 0
+    return f"{ema_value:.6f} {_EMA_ARROWS[sign + 1]} ({diff_percent:+.2f}%)"
+
+# Константы подписи Telegram
+_CAPTION_LEVELS = ("X", "F", "A", "C", "D", "Y")
+_CAPTION_EMA_PERIODS = (8, 54, 78, 200)
+_EMA_TREND_EMOJI = {
+    "сильный бычий": "📈📈",
+    "бычий": "📈",
+    "слабый бычий": "↗️",
+    "боковик": "➡️",
+    "слабый медвежий": "↘️",
+    "медвежий": "📉",
+    "сильный медвежий": "📉📉"
+}
+_OVERALL_TREND_NAMES = {"long": "📈 Бычий", "short": "📉 Медвежий"}
 
 def _format_caption(
     symbol: str, 
@@ -232,17 +270,16 @@ def _format_caption(
     
     open_time, close_time = _get_candle_time_range(c, tf)
     
-    main_levels = ["X", "F", "A", "C", "D", "Y"]
-    level_lines = []
-    for k in main_levels:
-        if k in levels:
-            level_lines.append(f"{k}: {levels[k]:.6f}")
+    level_lines = [f"{k}: {levels[k]:.6f}" for k in _CAPTION_LEVELS if k in levels]
+    level_rows = [f"• {a} | {b}" for a, b in zip(level_lines[0::2], level_lines[1::2])]
+    if len(level_lines) % 2:
+        level_rows.append(f"• {level_lines[-1]}")
     
-    ema_display = []
-    for period in [8, 54, 78, 200]:
-        ema_key = f"EMA_{period}"
-        if ema_key in emas and emas[ema_key] is not None:
-            ema_display.append(f"EMA-{period}: {_format_ema_value(price, emas[ema_key])}")
+    ema_display = [
+        f"• EMA-{period}: {_format_ema_value(price, value)}"
+        for period, value in ((p, emas.get(f"EMA_{p}")) for p in _CAPTION_EMA_PERIODS)
+        if value is not None
+    ]
     
     lines = [
         f"📈 #{symbol} • Таймфрейм: {tf}",
@@ -251,55 +288,136 @@ def _format_caption(
         f"📊 Проанализировано: {len(candles)} свечей",
     ]
     
-    if "_base_ts" in levels:
-        base_time = _ts_to_human_str(int(levels["_base_ts"]))
-        lines.append(f"🎯 Базовая свеча: {base_time}")
+    base_ts = levels.get("_base_ts")
+    if base_ts is not None:
+        lines.append(f"🎯 Базовая свеча: {_ts_to_human_str(int(base_ts))}")
     
-    if level_lines:
+    if level_rows:
         lines.append("\n🎯 Ключевые уровни:")
-        for i in range(0, len(level_lines), 2):
-            if i + 1 < len(level_lines):
-                lines.append(f"• {level_lines[i]} | {level_lines[i+1]}")
-            else:
-                lines.append(f"• {level_lines[i]}")
+        lines.extend(level_rows)
     
     if ema_display:
         lines.append("\n📊 EMA индикаторы:")
-        for ema_line in ema_display:
-            lines.append(f"• {ema_line}")
-        
-        if ema_analysis and "trend" in ema_analysis and ema_analysis["trend"] != "неопределён":
-            trend_emoji = {
-                "сильный бычий": "📈📈",
-                "бычий": "📈",
-                "слабый бычий": "↗️",
-                "боковик": "➡️",
-                "слабый медвежий": "↘️",
-                "медвежий": "📉",
-                "сильный медвежий": "📉📉"
-            }.get(ema_analysis["trend"], "➖")
-            
-            lines.append(f"\n🎯 Тренд по EMA: {trend_emoji} {ema_analysis['trend']}")
+        lines.extend(ema_display)
+        
+        ema_trend = ema_analysis.get("trend") if ema_analysis else None
+        if ema_trend is not None and ema_trend != "неопределён":
+            trend_emoji = _EMA_TREND_EMOJI.get(ema_trend, "➖")
+            lines.append(f"\n🎯 Тренд по EMA: {trend_emoji} {ema_trend}")
             lines.append(f"Сила тренда: {ema_analysis.get('strength', 0)}%")
             
-            if ema_analysis.get("signals"):
-                signals_text = ", ".join(ema_analysis["signals"][:3])
-                lines.append(f"📶 Сигналы: {signals_text}")
+            signals = ema_analysis.get("signals")
+            if signals:
+                lines.append(f"📶 Сигналы: {', '.join(signals[:3])}")
     
     if pats:
-        lines.append(f"\n🎯 Паттерны:")
-        for pat in pats:
-            lines.append(f"• {pat}")
+        lines.append("\n🎯 Паттерны:")
+        lines.extend(f"• {pat}" for pat in pats)
     
     lines.append(f"\n📊 RSI14: {_rsi_tag(rsi14)}")
     
-    if trend_info and trend_info.get("trend") != "neutral":
-        trend_name = {"long": "📈 Бычий", "short": "📉 Медвежий"}.get(trend_info["trend"], "➖ Нейтральный")
+    overall_trend = trend_info.get("trend") if trend_info else None
+    if trend_info and overall_trend != "neutral":
+        trend_name = _OVERALL_TREND_NAMES.get(overall_trend, "➖ Нейтральный")
         conf = trend_info.get("confidence", 0) * 100
         lines.append(f"🚀 Общий тренд: {trend_name} ({conf:.0f}%)")
     
     return "\n".join(lines)
 
+_SOA_FIELDS = ("ts", "open", "high", "low", "close", "volume")
+
+def _fill_soa_row(arrays: Tuple[np.ndarray, ...], i: int, candle: Dict) -> None:
+    """Записывает одну свечу в i-ю строку SoA-массивов."""
+    for arr, field in zip(arrays, _SOA_FIELDS):
+        arr[i] = candle.get(field) or 0
+
+def _candles_to_soa(key: str, candles: List[Dict]) -> Tuple[np.ndarray, ...]:
+    """
+    Переводит список свечей в параллельные массивы (ts, open, high, low, close, volume).
+    Результат кэшируется по ключу: на том же наборе свечей обновляется только
+    формирующаяся свеча, при сдвиге окна на одну свечу — две последние.
+    """
+    n = len(candles)
+    sig = (n, int(candles[0].get("ts", 0)), int(candles[-1].get("ts", 0))) if n else (0, 0, 0)
+    cached = _soa_cache.get(key)
+    
+    if cached and cached[0] == sig:
+        arrays = cached[1]
+        _fill_soa_row(arrays, n - 1, candles[-1])
+    elif cached and n >= 2 and cached[0][0] == n and cached[0][2] == int(candles[-2].get("ts", 0)):
+        arrays = cached[1]
+        for arr in arrays:
+            arr[:-1] = arr[1:]
+        _fill_soa_row(arrays, n - 2, candles[-2])
+        _fill_soa_row(arrays, n - 1, candles[-1])
+    else:
+        arrays = (np.empty(n, dtype=np.int64),) + tuple(np.empty(n, dtype=np.float64) for _ in range(5))
+        for i, c in enumerate(candles):
+            _fill_soa_row(arrays, i, c)
+    
+    _soa_cache[key] = (sig, arrays)
+    return arrays
+
+_EMA_PERIODS = (8, 54, 78, 200)
+_RSI_PERIOD = 14
+
+def _incremental_emas(key: str, candles: List[Dict], closes: np.ndarray) -> Dict[str, Optional[float]]:
+    """
+    EMA-8/54/78/200 для последнего бара, совпадающие с calculate_all_emas(candles) бит в бит.
+    EMA закрытой свечи candles[-2] считается полным проходом по окну один раз на закрытую
+    свечу, тики формирующейся свечи добавляют к нему один шаг. Состояние между сдвигами
+    окна не переносится: EMA-200 на окне из 250 свечей заметно зависит от стартовой SMA,
+    и перенос уводил его от пересчёта по окну до ~1.7% в зависимости от времени работы.
+    """
+    if len(closes) <= max(_EMA_PERIODS):
+        return calculate_all_emas(closes)
+    
+    # Окно определяется длиной, первой свечой и последней закрытой свечой
+    window = (len(closes), int(candles[0].get("ts", 0)), int(candles[-2].get("ts", 0)))
+    st = _ema_state.get(key)
+    if st is None or st[0] != window:
+        st = _ema_state[key] = (window, calculate_all_emas(closes[:-1]))
+    
+    last_close = float(closes[-1])
+    prev = st[1]
+    result: Dict[str, Optional[float]] = {}
+    for period in _EMA_PERIODS:
+        k = 2.0 / (period + 1.0)
+        result[f"EMA_{period}"] = last_close * k + prev[f"EMA_{period}"] * (1.0 - k)
+    
+    return result
+
+def _incremental_rsi(
+    key: str,
+    candles: List[Dict],
+    closes: np.ndarray,
+    period: int = _RSI_PERIOD
+) -> Optional[float]:
+    """RSI для последнего бара; средние закрытой свечи считаются по окну раз на свечу."""
+    if len(candles) < period + 2:
+        return calculate_rsi(closes, period)
+    
+    # Как и для EMA: средние закрытой свечи пересчитываются по окну на каждую новую
+    # закрытую свечу, между тиками одной свечи переиспользуются
+    window = (len(closes), int(candles[0].get("ts", 0)), int(candles[-2].get("ts", 0)))
+    prev_close = float(closes[-2])
+    last_close = float(closes[-1])
+    
+    st = _rsi_state.get(key)
+    if st and st[0] == window:
+        avg_gain, avg_loss = st[1], st[2]
+    else:
+        avg_gain, avg_loss = wilder_averages(closes[:-1], period)
+        _rsi_state[key] = (window, avg_gain, avg_loss)
+    
+    avg_gain, avg_loss = wilder_step(avg_gain, avg_loss, last_close - prev_close, period)
+    
+    if avg_loss == 0:
+        return 100.0
+    
+    rs = avg_gain / avg_loss
+    return 100.0 - (100.0 / (1.0 + rs))
+
 def check_collisions(levels: List[float], zones: List[Dict], current_price: float) -> List[Dict]:
     """
     Проверяет совпадения уровней с маржинальными зонами.
@@ -310,40 +428,59 @@ def check_collisions(levels: List[float], zones: List[Dict], current_price: floa
     if not levels or not zones:
         return collisions
     
-    for level in levels:
-        for zone in zones:
-            zone_low = zone.get('low', 0)
-            zone_high = zone.get('high', 0)
-            
-            # Расширяем границы зоны на порог совпадения (0.105%)
-            lower_bound = zone_low * (1 - COLLISION_THRESHOLD_PERCENT / 100)
-            upper_bound = zone_high * (1 + COLLISION_THRESHOLD_PERCENT / 100)
-            
-            # Проверяем, находится ли уровень внутри расширенной зоны
-            if lower_bound <= level <= upper_bound:
-                # Вычисляем расстояние до центра зоны
-                zone_center = (zone_low + zone_high) / 2
-                distance_to_center = abs(level - zone_center)
-                distance_percent = (distance_to_center / zone_center) * 100 if zone_center != 0 else 0
-                
-                # Определяем позицию относительно зоны
-                if level < zone_low:
-                    position = "ниже зоны"
-                elif level > zone_high:
-                    position = "выше зоны"
-                else:
-                    position = "внутри зоны"
-                
-                collisions.append({
-                    'level': level,
-                    'zone_low': zone_low,
-                    'zone_high': zone_high,
-                    'zone_center': zone_center,
-                    'distance_percent': distance_percent,
-                    'position': position,
-                    'zone_strength': zone.get('strength', 0)
-                })
-                break  # Каждый уровень может совпадать только с одной зоной
+    # Расширяем границы зон на порог совпадения (0.105%) сразу для всех зон
+    lower = np.fromiter((z.get('low', 0) for z in zones), dtype=np.float64, count=len(zones))
+    upper = np.fromiter((z.get('high', 0) for z in zones), dtype=np.float64, count=len(zones))
+    lower *= 1 - COLLISION_THRESHOLD_PERCENT / 100
+    upper *= 1 + COLLISION_THRESHOLD_PERCENT / 100
+    lv = np.asarray(levels, dtype=np.float64)
+    
+    order = np.argsort(lower, kind="stable")
+    lower_sorted = lower[order]
+    upper_sorted = upper[order]
+    if len(zones) < 2 or bool(np.all(upper_sorted[:-1] < lower_sorted[1:])):
+        # Расширенные зоны не пересекаются: уровень попадает не более чем в одну —
+        # ту, у которой ближайшая снизу нижняя граница (бинарный поиск)
+        idx = np.searchsorted(lower_sorted, lv, side="right") - 1
+        found = idx >= 0
+        idx[~found] = 0
+        hit = found & (lv <= upper_sorted[idx])
+        zone_idx = order[idx]
+    else:
+        # Зоны пересекаются: как и при переборе, берётся первая по списку зона с уровнем
+        inside = (lv[:, None] >= lower) & (lv[:, None] <= upper)
+        hit = inside.any(axis=1)
+        zone_idx = inside.argmax(axis=1)
+    
+    # Каждый уровень может совпадать только с одной зоной
+    for i, z in zip(np.flatnonzero(hit).tolist(), zone_idx[hit].tolist()):
+        level = levels[i]
+        zone = zones[z]
+        zone_low = zone.get('low', 0)
+        zone_high = zone.get('high', 0)
+        
+        # Вычисляем расстояние до центра зоны
+        zone_center = (zone_low + zone_high) / 2
+        distance_to_center = abs(level - zone_center)
+        distance_percent = (distance_to_center / zone_center) * 100 if zone_center != 0 else 0
+        
+        # Определяем позицию относительно зоны
+        if level < zone_low:
+            position = "ниже зоны"
+        elif level > zone_high:
+            position = "выше зоны"
+        else:
+            position = "внутри зоны"
+        
+        collisions.append({
+            'level': level,
+            'zone_low': zone_low,
+            'zone_high': zone_high,
+            'zone_center': zone_center,
+            'distance_percent': distance_percent,
+            'position': position,
+            'zone_strength': zone.get('strength', 0)
+        })
     
     return collisions
 
@@ -360,11 +497,31 @@ async def _fetch_with_retry(
         try:
             return await fetch_kline(sess, symbol, tf, limit=limit)
         except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
-            logging.warning("[BYBIT] Попытка %s не удалась: %s", attempt, e)
+            logger.warning("[BYBIT] Попытка %s не удалась: %s", attempt, e)
             if attempt == 5:
                 return None
     return None
 
+def _tick_fetch(
+    tick_fetches: Optional[Dict[Tuple[str, str], asyncio.Task]],
+    sess: aiohttp.ClientSession,
+    symbol: str,
+    tf: str,
+    limit: int = 250
+) -> Awaitable[Optional[List[Dict]]]:
+    """
+    Загрузка свечей, общая для всех пар одной итерации main_loop: запрос (symbol, tf)
+    выполняется один раз, остальные пары ждут ту же задачу.
+    Без tick_fetches — обычная загрузка.
+    """
+    if tick_fetches is None:
+        return _fetch_with_retry(sess, symbol, tf, limit)
+    task = tick_fetches.get((symbol, tf))
+    if task is None:
+        task = tick_fetches[(symbol, tf)] = asyncio.ensure_future(_fetch_with_retry(sess, symbol, tf, limit))
+    # shield: отмена одной из ожидающих пар не должна отменять загрузку для остальных
+    return asyncio.shield(task)
+
 def _check_breakout_and_recalculate(
     candles: List[Dict],
     current_levels: Dict[str, float],
@@ -390,34 +547,35 @@ def _check_breakout_and_recalculate(
     if not is_breakout:
         return current_levels, False, "Цена в пределах структуры"
     
-    last_breakout = _last_breakout_time.get(key, 0)
-    current_time = int(time.time() * 1000)
-    cooldown = 5 * 60 * 1000
+    last_breakout = _last_breakout_time.get(key)
+    current_time = _now_ms()
     
-    if current_time - last_breakout < cooldown:
-        remaining = (cooldown - (current_time - last_breakout)) // 1000
+    if last_breakout is not None and current_time - last_breakout < _COOLDOWN_MS:
+        remaining = (_COOLDOWN_MS - (current_time - last_breakout)) // 1000
         return current_levels, False, f"Кулдаун активен ({remaining} сек)"
     
     if len(candles) < 50:
         return current_levels, True, f"ПРОБОЙ! Недостаточно данных для поиска новой структуры (только {len(candles)} свечей)"
     
-    logging.info(f"[BREAKOUT] Пробой структуры {symbol}/{tf}: цена={current_price:.6f}, X={x:.6f}, Y={y:.6f}")
+    logger.info("[BREAKOUT] Пробой структуры %s/%s: цена=%.6f, X=%.6f, Y=%.6f", symbol, tf, current_price, x, y)
     
     min_lookback = 190
     lookback = min_lookback if len(candles) >= min_lookback else len(candles)
     
+    # Окно поиска задаём границами, без копирования среза свечей
     search_start = -lookback
     search_end = -5 if len(candles) > 5 else None
-    search_candles = candles[search_start:search_end] if search_end else candles[search_start:]
+    lo, hi, _ = slice(search_start, search_end).indices(len(candles))
     
-    if not search_candles:
-        search_candles = candles[-lookback:]
+    if hi <= lo:
+        search_end = None
+        lo, hi, _ = slice(search_start, search_end).indices(len(candles))
     
-    logging.info(f"[BREAKOUT] Поиск в {len(search_candles)} свечах для {symbol}/{tf}")
+    logger.info("[BREAKOUT] Поиск в %d свечах для %s/%s", hi - lo, symbol, tf)
     
-    new_base = pick_biggest_candle(search_candles)
+    new_base = pick_biggest_candle(candles, search_start, search_end)
     if not new_base:
-        new_base = pick_biggest_candle(candles[-100:]) if len(candles) >= 100 else pick_biggest_candle(candles)
+        new_base = pick_biggest_candle(candles, -100)
     
     if not new_base:
         return current_levels, True, f"ПРОБОЙ! Не удалось найти новую базовую свечу для {symbol}/{tf}"
@@ -428,7 +586,7 @@ def _check_breakout_and_recalculate(
     if old_base_ts and new_base.get("ts") == old_base_ts:
         same_base = True
         new_levels = current_levels
-        logging.info(f"[BREAKOUT] Базовая свеча та же для {symbol}/{tf}")
+        logger.info("[BREAKOUT] Базовая свеча та же для %s/%s", symbol, tf)
     else:
         new_levels = calculate_levels_for_candle(new_base)
         new_levels["_base_ts"] = new_base["ts"]
@@ -459,10 +617,18 @@ def _check_breakout_and_recalculate(
             f"Новые уровни: X={new_levels.get('X', 0):.6f}, Y={new_levels.get('Y', 0):.6f}"
         )
     
-    logging.info(f"[BREAKOUT] {'Базовая свеча та же' if same_base else 'Новые уровни'} для {symbol}/{tf}")
+    logger.info("[BREAKOUT] %s для %s/%s", "Базовая свеча та же" if same_base else "Новые уровни", symbol, tf)
     
     return new_levels, True, description
 
+def _reset_break_state(key: str) -> None:
+    """Сбрасывает состояние пробоя для ключа в «inside»."""
+    _break_mode[key] = "inside"
+    _break_count[key] = 0
+    _break_latched[key] = False
+    _wait_new_candle[key] = False
+    _latched_on_ts[key] = -1
+
 def _update_break_state(
     key: str, 
     close_price: float, 
@@ -474,37 +640,25 @@ def _update_break_state(
     y = levels.get("Y")
     
     if x is None or y is None:
-        _break_mode[key] = "inside"
-        _break_count[key] = 0
-        _break_latched[key] = False
-        _wait_new_candle[key] = False
-        _latched_on_ts[key] = -1
+        _reset_break_state(key)
         return
     
-    if close_price > float(y):
+    if close_price > y:
         mode = "aboveY"
-    elif close_price < float(x):
+    elif close_price < x:
         mode = "belowX"
     else:
-        mode = "inside"
-    
-    prev_mode = _break_mode.get(key, "inside")
-    
-    if mode == "inside":
-        _break_mode[key] = "inside"
-        _break_count[key] = 0
-        _break_latched[key] = False
-        _wait_new_candle[key] = False
-        _latched_on_ts[key] = -1
+        _reset_break_state(key)
         return
     
-    if mode == prev_mode:
-        _break_count[key] = _break_count.get(key, 0) + 1
+    if mode == _break_mode.get(key, "inside"):
+        count = _break_count.get(key, 0) + 1
     else:
         _break_mode[key] = mode
-        _break_count[key] = 1
+        count = 1
+    _break_count[key] = count
     
-    if _break_count[key] >= 6:
+    if count >= 6:
         if not _break_latched.get(key, False):
             _latched_on_ts[key] = curr_ts
         _break_latched[key] = True
@@ -526,19 +680,17 @@ async def _send_levels_message(
 ) -> bool:
     """Отправляет сообщение с уровнями и графиком."""
     try:
-        # Генерируем график
-        img_path = os.path.join(OUT_DIR, f"{symbol}_{tf}_{int(time.time())}.png")
-        
+        # Генерируем график сразу в память, без записи на диск
         title = f"{symbol} {tf}"
         if rsi14:
             title += f"  RSI={rsi14:.1f}"
         
-        os.makedirs(os.path.dirname(img_path), exist_ok=True)
-        
-        plot_png(candles, current_levels, img_path, title=title)
+        png_bytes = await asyncio.get_running_loop().run_in_executor(
+            _plot_pool, partial(plot_png_bytes, candles, current_levels, title=title)
+        )
         
-        if not os.path.exists(img_path) or os.path.getsize(img_path) < 1000:
-            logging.error("[CHART] Не удалось создать график для %s/%s", symbol, tf)
+        if len(png_bytes) < 1000:
+            logger.error("[CHART] Не удалось создать график для %s/%s", symbol, tf)
             return False
         
         # Формируем подпись
@@ -547,14 +699,17 @@ async def _send_levels_message(
         if breakout_description and "ПРОБОЙ" in breakout_description:
             cap = f"🚨 {breakout_description}\n\n{cap}"
         
-        logging.info(f"Отправка фото для {symbol}/{tf}")
+        logger.info("Отправка фото для %s/%s", symbol, tf)
         
-        ok = await tg.send_photo(img_path, cap)
+        filename = f"{symbol}_{tf}_{next(_img_seq)}.png"
+        ok = await tg.sender.enqueue(
+            partial(tg.send_photo_bytes, png_bytes, cap, filename=filename), upload=True
+        )
         
         return ok
         
     except Exception as e:
-        logging.error("[CHART] Ошибка построения графика: %s", e)
+        logger.error("[CHART] Ошибка построения графика: %s", e)
         return False
 
 async def _send_zones_message(
@@ -606,7 +761,7 @@ async def _send_zones_message(
 ⏰ {time.strftime('%H:%M:%S')}
 """
     
-    return await tg.send_message(message)
+    return await tg.send_message_queued(message)
 
 async def _send_collisions_message(
     tg: TelegramBot,
@@ -653,33 +808,40 @@ async def _send_collisions_message(
 ⏰ {time.strftime('%H:%M:%S')}
 """
     
-    return await tg.send_message(message)
+    return await tg.send_message_queued(message)
 
 async def run_symbol_tf(
     sess: aiohttp.ClientSession, 
     tg: TelegramBot,
     symbol: str, 
-    tf: str
+    tf: str,
+    tick_fetches: Optional[Dict[Tuple[str, str], asyncio.Task]] = None
 ) -> bool:
-    """Обрабатывает одну пару символ/ТФ."""
+    """
+    Обрабатывает одну пару символ/ТФ.
+
+    tick_fetches — загрузки свечей текущей итерации main_loop по (symbol, tf):
+    старший ТФ, который у символа обрабатывается и как своя пара
+    (ADA 15m -> 1h и ADA 1h), берётся из той же загрузки, а не запрашивается повторно.
+    """
     key = _key(symbol, tf)
     sent_messages = 0
     
     try:
         # 1. Загружаем свечи
-        candles = await _fetch_with_retry(sess, symbol, tf, 250)
+        candles = await _tick_fetch(tick_fetches, sess, symbol, tf, 250)
         if not candles:
-            logging.warning("[WARN] Нет свечей для %s/%s", symbol, tf)
+            logger.warning("[WARN] Нет свечей для %s/%s", symbol, tf)
             return False
         
-        c_last = candles[-1]
-        curr_price = float(c_last.get("close", 0))
-        curr_ts = int(c_last.get("ts", 0))
+        # SoA-массивы считаются один раз на тик и переиспользуются индикаторами
+        soa_ts, soa_open, soa_high, soa_low, soa_close, _ = _candles_to_soa(key, candles)
+        curr_price = float(soa_close[-1])
+        curr_ts = int(soa_ts[-1])
         
-        # 2. Проверяем, не отправляли ли уже эту свечу (для уровней)
-        if _last_sent_candle_ts.get(key) == curr_ts:
-            # Проверяем только для уровней, зоны могут обновляться независимо
-            pass
+        # 2. Проверяем, не отправляли ли уже эту свечу (для уровней).
+        #    Решение принимаем после проверки пробоя в п.3
+        candle_already_sent = _last_sent_candle_ts.get(key) == curr_ts
         
         # 3. Получаем текущие уровни или рассчитываем новые
         current_levels = _current_levels.get(key)
@@ -690,7 +852,7 @@ async def run_symbol_tf(
         if not current_levels:
             current_levels = calculate_levels(candles, symbol, tf, use_biggest_from_last=240)
             if not current_levels:
-                logging.warning("[WARN] Не удалось расчитать уровни для %s/%s", symbol, tf)
+                logger.warning("[WARN] Не удалось расчитать уровни для %s/%s", symbol, tf)
                 return False
             _current_levels[key] = current_levels
             need_send_message = True
@@ -708,68 +870,85 @@ async def run_symbol_tf(
                     _current_levels[key] = current_levels
                 
                 need_send_message = True
-                
-                _break_mode[key] = "inside"
-                _break_count[key] = 0
-                _break_latched[key] = False
-                _wait_new_candle[key] = False
-                _latched_on_ts[key] = -1
-        
-        # 4. Добавляем timestamp базовой свечи
-        base = pick_biggest_candle(candles[-240:])
-        if base and "ts" in base:
-            current_levels["_base_ts"] = base["ts"]
-        
-        # 5. Определяем паттерны
-        lookback = min(len(candles), _bars_24h(tf))
-        pats = detect_patterns(candles[-lookback:])
-        
-        # 6. Рассчитываем RSI
-        rsi14 = calculate_rsi(candles)
-        
-        # 7. Рассчитываем EMA
-        emas = calculate_all_emas(candles)
-        ema_analysis = ema_trend_analysis(emas, curr_price)
-        
-        # 8. Анализ тренда
-        trend_info = None
-        if tf in ["5m", "15m", "1h"]:
-            tf_map = {"5m": "15m", "15m": "1h", "1h": "4h", "4h": "4h"}
-            tf_higher = tf_map.get(tf, tf)
+                _reset_break_state(key)
+        
+        # 4. Добавляем timestamp базовой свечи (только когда уровни могли смениться,
+        #    иначе _base_ts уже лежит в current_levels с прошлой итерации)
+        if need_send_message or breakout_detected:
+            base = pick_biggest_candle(candles, -240, ohlc=(soa_open, soa_high, soa_low, soa_close))
+            if base and "ts" in base:
+                current_levels["_base_ts"] = base["ts"]
+        
+        # 4a. Свеча уже отправлена, уровни не менялись и пробой не защёлкнут —
+        #     индикаторы, тренд и состояние пробоя не пересчитываем.
+        #     MTF на этом заканчивает, STF ещё проверяет зоны и совпадения
+        skip_levels = (
+            candle_already_sent
+            and not need_send_message
+            and not _break_latched.get(key, False)
+        )
+        if skip_levels:
+            logger.debug("[SKIP] %s/%s: свеча %s уже отправлена", symbol, tf, curr_ts)
+            if tf not in STF_GROUP:
+                _last_price[key] = curr_price
+                return False
+        
+        should_send_levels = False
+        if not skip_levels:
+            # 5. Определяем паттерны
+            lookback = min(len(candles), _bars_24h(tf))
+            pats = detect_patterns(candles[-lookback:])
+        
+            # 6. Рассчитываем RSI
+            rsi14 = _incremental_rsi(key, candles, soa_close)
+        
+            # 7. Рассчитываем EMA
+            emas = _incremental_emas(key, candles, soa_close)
+            ema_analysis = ema_trend_analysis(emas, curr_price)
+        
+            # 8. Анализ тренда
+            trend_info = None
+            if tf in ["5m", "15m", "1h"]:
+                tf_map = {"5m": "15m", "15m": "1h", "1h": "4h", "4h": "4h"}
+                tf_higher = tf_map.get(tf, tf)
             
-            candles_higher = await _fetch_with_retry(sess, symbol, tf_higher, 120)
-            if candles_higher:
-                try:
-                    trend_info = analyze_trend(candles, candles_higher)
-                except Exception as e:
-                    logging.warning("[TREND] Ошибка анализа тренда: %s", e)
-                    trend_info = None
-        
-        # 9. Обновляем состояние пробоя
-        _update_break_state(key, curr_price, current_levels, curr_ts)
-        
-        latched = _break_latched.get(key, False)
-        latched_ts = _latched_on_ts.get(key, -1)
-        need_new = _wait_new_candle.get(key, False)
-        
-        # 10. Проверяем условия для отправки уровней
-        should_send_levels = (
-            latched and 
-            need_new and 
-            curr_ts != latched_ts and 
-            curr_ts > latched_ts >= 0
-        ) or need_send_message
-        
-        # 11. Проверяем, не отправляли ли уже эти уровни
-        state = _state_signature(current_levels)
-        if _last_state.get(key) == state and not need_send_message:
-            # Уровни не изменились
-            should_send_levels = False
-        else:
-            # Сохраняем уровни
-            level_values = [current_levels.get(k) for k in ["X", "A", "C", "D", "F", "Y"] 
-                           if current_levels.get(k) is not None]
-            _levels_data[key] = level_values
+                # Свой ТФ символа грузится на 250 свечей — совпадаем с ним по запросу
+                own_tf = tf_higher in SYMBOLS_TFS.get(symbol, ())
+                candles_higher = await _tick_fetch(
+                    tick_fetches, sess, symbol, tf_higher, 250 if own_tf else 120
+                )
+                if candles_higher:
+                    try:
+                        trend_info = analyze_trend(candles, candles_higher)
+                    except Exception as e:
+                        logger.warning("[TREND] Ошибка анализа тренда: %s", e)
+                        trend_info = None
+        
+            # 9. Обновляем состояние пробоя
+            _update_break_state(key, curr_price, current_levels, curr_ts)
+        
+            latched = _break_latched.get(key, False)
+            latched_ts = _latched_on_ts.get(key, -1)
+            need_new = _wait_new_candle.get(key, False)
+        
+            # 10. Проверяем условия для отправки уровней
+            should_send_levels = (
+                latched and 
+                need_new and 
+                curr_ts != latched_ts and 
+                curr_ts > latched_ts >= 0
+            ) or need_send_message
+        
+            # 11. Проверяем, не отправляли ли уже эти уровни
+            state = _state_signature(current_levels)
+            if _last_state.get(key) == state and not need_send_message:
+                # Уровни не изменились
+                should_send_levels = False
+            else:
+                # Сохраняем уровни
+                level_values = [current_levels.get(k) for k in ["X", "A", "C", "D", "F", "Y"] 
+                               if current_levels.get(k) is not None]
+                _levels_data[key] = level_values
         
         # 12. ОБРАБОТКА ДЛЯ РАЗНЫХ ГРУПП ТАЙМФРЕЙМОВ
         if tf in MTF_GROUP:
@@ -785,7 +964,7 @@ async def run_symbol_tf(
                     _last_price[key] = curr_price
                     _wait_new_candle[key] = False
                     sent_messages += 1
-                    logging.info("[MTF] Уровни отправлены для %s/%s", symbol, tf)
+                    logger.info("[MTF] Уровни отправлены для %s/%s", symbol, tf)
         
         elif tf in STF_GROUP:
             # ДЛЯ STF: уровни + маржинальные зоны + совпадения
@@ -802,7 +981,7 @@ async def run_symbol_tf(
                     )
                     _zones_data[key] = current_zones
                 except Exception as e:
-                    logging.error(f"[MarginZone] Ошибка получения зон {symbol}/{tf}: {e}")
+                    logger.error("[MarginZone] Ошибка получения зон %s/%s: %s", symbol, tf, e)
             
             # B) Проверяем совпадения уровней с зонами
             current_collisions = []
@@ -824,7 +1003,7 @@ async def run_symbol_tf(
                     _last_price[key] = curr_price
                     _wait_new_candle[key] = False
                     sent_messages += 1
-                    logging.info("[STF] Уровни отправлены для %s/%s", symbol, tf)
+                    logger.info("[STF] Уровни отправлены для %s/%s", symbol, tf)
             
             # 2. Отправляем маржинальные зоны (если есть и изменились)
             zones_state = _zones_signature(current_zones)
@@ -833,7 +1012,7 @@ async def run_symbol_tf(
                 if ok:
                     _last_zones_state[key] = zones_state
                     sent_messages += 1
-                    logging.info("[STF] Зоны отправлены для %s/%s", symbol, tf)
+                    logger.info("[STF] Зоны отправлены для %s/%s", symbol, tf)
             
             # 3. Отправляем совпадения (если есть и изменились)
             collisions_state = _collisions_signature(current_collisions)
@@ -842,7 +1021,7 @@ async def run_symbol_tf(
                 if ok:
                     _last_collisions_state[key] = collisions_state
                     sent_messages += 1
-                    logging.info("[STF] Совпадения отправлены для %s/%s", symbol, tf)
+                    logger.info("[STF] Совпадения отправлены для %s/%s", symbol, tf)
         
         # Обновляем цену
         _last_price[key] = curr_price
@@ -850,65 +1029,82 @@ async def run_symbol_tf(
         return sent_messages > 0
         
     except Exception as e:
-        logging.error("[ERROR] %s/%s: %s", symbol, tf, e)
-        import traceback
-        logging.error(traceback.format_exc())
+        # Трейсбек форматируется самим logging и только если запись пройдёт по уровню
+        logger.exception("[ERROR] %s/%s: %s", symbol, tf, e)
         return False
 
 async def main_loop() -> None:
     """Основной цикл бота."""
-    global _last_banner_ts
+    global _last_banner_ts, _plot_pool
     
-    logging.info("=" * 60)
-    logging.info("🚀 Бот запускается...")
-    logging.info(f"Python: {sys.version}")
-    logging.info(f"Working Directory: {os.getcwd()}")
-    logging.info(f"MarginZone доступен: {MARGINZONE_AVAILABLE}")
-    logging.info(f"MTF таймфреймы: {MTF_GROUP}")
-    logging.info(f"STF таймфреймы: {STF_GROUP}")
-    logging.info("=" * 60)
+    logger.info("=" * 60)
+    logger.info("🚀 Бот запускается...")
+    logger.info("Python: %s", sys.version)
+    logger.info("Working Directory: %s", os.getcwd())
+    logger.info("MarginZone доступен: %s", MARGINZONE_AVAILABLE)
+    logger.info("MTF таймфреймы: %s", MTF_GROUP)
+    logger.info("STF таймфреймы: %s", STF_GROUP)
+    logger.info("=" * 60)
     
     # Инициализируем Telegram бота
     try:
         tg = TelegramBot(TG_TOKEN, TG_CHAT_ID)
-        logging.info("✅ Telegram бот инициализирован")
+        logger.info("✅ Telegram бот инициализирован")
     except Exception as e:
-        logging.error(f"❌ Ошибка инициализации Telegram бота: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logger.exception("❌ Ошибка инициализации Telegram бота: %s", e)
         return
     
     # Инициализируем HTTP сессию
     try:
         sess = aiohttp.ClientSession()
-        logging.info("✅ HTTP сессия создана")
+        logger.info("✅ HTTP сессия создана")
     except Exception as e:
-        logging.error(f"❌ Ошибка создания HTTP сессии: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logger.exception("❌ Ошибка создания HTTP сессии: %s", e)
         return
     
+    # spawn: не форкаем процесс с живым event loop и открытыми сессиями
+    _plot_pool = ProcessPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 2) // 2),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    
     TF_SLEEP = 60
     error_count = 0
     max_errors = 5
     
-    logging.info("🚀 Основной цикл начат")
+    logger.info("🚀 Основной цикл начат")
+    pairs_sem = asyncio.Semaphore(MAX_CONCURRENT_PAIRS)
+    
+    async def run_pair(
+        symbol: str,
+        tf: str,
+        tick_fetches: Dict[Tuple[str, str], asyncio.Task]
+    ) -> Optional[bool]:
+        """Обработка одной пары под семафором; None — пара завершилась ошибкой."""
+        async with pairs_sem:
+            try:
+                sent = await run_symbol_tf(sess, tg, symbol, tf, tick_fetches)
+                await asyncio.sleep(0.1)
+                return sent
+            except Exception as e:
+                logger.error("Ошибка обработки %s/%s: %s", symbol, tf, e)
+                return None
     
     try:
         while error_count < max_errors:
             sent_count = 0
             start_time = time.time()
+            tick_fetches: Dict[Tuple[str, str], asyncio.Task] = {}
             
             try:
-                for symbol, tfs in SYMBOLS_TFS.items():
-                    for tf in tfs:
-                        try:
-                            if await run_symbol_tf(sess, tg, symbol, tf):
-                                sent_count += 1
-                            await asyncio.sleep(0.1)
-                        except Exception as e:
-                            logging.error(f"Ошибка обработки {symbol}/{tf}: {e}")
-                            error_count += 1
+                # Пары независимы: сетевые ожидания перекрываются, параллелизм ограничен семафором
+                results = await asyncio.gather(*(
+                    run_pair(symbol, tf, tick_fetches)
+                    for symbol, tfs in SYMBOLS_TFS.items()
+                    for tf in tfs
+                ))
+                sent_count = sum(1 for r in results if r)
+                error_count += sum(1 for r in results if r is None)
                 
                 now = time.time()
                 if sent_count > 0 and (now - _last_banner_ts) >= 1800:
@@ -921,7 +1117,7 @@ MarginZone активен: {'Да' if MARGINZONE_AVAILABLE else 'Нет'}"""
                     
                     if await tg.send_message(banner_text):
                         _last_banner_ts = now
-                        logging.info("[BANNER] Отправлен баннер")
+                        logger.info("[BANNER] Отправлен баннер")
                 
                 # Сброс счетчика ошибок при успешной итерации
                 if sent_count > 0:
@@ -929,34 +1125,35 @@ MarginZone активен: {'Да' if MARGINZONE_AVAILABLE else 'Нет'}"""
                 
                 loop_time = time.time() - start_time
                 if loop_time > TF_SLEEP:
-                    logging.warning("[PERF] Цикл занял %.2fс (дольше чем интервал %dс)", 
-                                  loop_time, TF_SLEEP)
+                    logger.warning("[PERF] Цикл занял %.2fс (дольше чем интервал %dс)",
+                                   loop_time, TF_SLEEP)
                 
                 sleep_time = max(1, TF_SLEEP - loop_time)
                 await asyncio.sleep(sleep_time)
                 
             except Exception as e:
-                logging.error(f"❌ Ошибка в основном цикле: {e}")
-                import traceback
-                logging.error(traceback.format_exc())
+                logger.exception("❌ Ошибка в основном цикле: %s", e)
                 error_count += 1
                 await asyncio.sleep(30)
         
-        logging.error(f"🛑 Достигнут максимум ошибок ({max_errors}), бот останавливается")
+        logger.error("🛑 Достигнут максимум ошибок (%d), бот останавливается", max_errors)
         
     except (asyncio.CancelledError, KeyboardInterrupt):
-        logging.info("🛑 Бот остановлен по запросу")
+        logger.info("🛑 Бот остановлен по запросу")
     except Exception as e:
-        logging.error(f"❌ Критическая ошибка: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logger.exception("❌ Критическая ошибка: %s", e)
     finally:
         # Корректное завершение
+        await tg.sender.close()
+        await close_tg_session()
         try:
             await sess.close()
-            logging.info("✅ HTTP сессия закрыта")
+            logger.info("✅ HTTP сессия закрыта")
         except:
             pass
+        if _plot_pool is not None:
+            _plot_pool.shutdown(wait=False, cancel_futures=True)
+            _plot_pool = None
 
 if __name__ == "__main__":
     try:
@@ -965,7 +1162,5 @@ if __name__ == "__main__":
         print("\n🛑 Бот остановлен пользователем")
         sys.exit(0)
     except Exception as e:
-        logging.error(f"❌ Критическая ошибка при запуске: {e}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logger.exception("❌ Критическая ошибка при запуске: %s", e)
         sys.exit(1)
\ No newline at end of file
@@ -4,11 +4,14 @@ ENGINE: Детектор маржинальных зон давления (ло
 Интеграция: в основной цикл бота, после получения новых свечей.
 """
 
+from collections import deque
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple, Tuple
 import logging
 
+import numpy as np
+
 class ZoneState(Enum):
     """Фаза жизненного цикла маржинальной зоны."""
     WAIT = auto()
@@ -19,24 +22,30 @@ class ZoneState(Enum):
     EXIT_IMPULSE = auto()
     EXPIRED = auto()
 
-@dataclass
-class Candle:
-    """Универсальный адаптер свечи."""
+class Candle(NamedTuple):
+    """Одна свеча (неизменяемая, на базе tuple)."""
     ts: int
     open: float
     high: float
     low: float
     close: float
-    
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'Candle':
-        return cls(
-            ts=int(data.get('timestamp', data.get('time', 0))),
-            open=float(data['open']),
-            high=float(data['high']),
-            low=float(data['low']),
-            close=float(data['close'])
-        )
+
+def _dict_ts(d: Dict[str, Any]) -> int:
+    """Время свечи из словаря (ts / timestamp / time)."""
+    return int(d.get('ts', d.get('timestamp', d.get('time', 0))))
+
+def _candle_from_dict(d: Dict[str, Any]) -> Candle:
+    """Свеча-словарь -> Candle."""
+    return Candle(_dict_ts(d), float(d['open']), float(d['high']), float(d['low']), float(d['close']))
+
+def _candles_from_dicts(dicts: List[Dict[str, Any]]) -> Tuple[np.ndarray, ...]:
+    """Список свечей-словарей -> параллельные массивы (ts, open, high, low, close)."""
+    n = len(dicts)
+    ts = np.fromiter((_dict_ts(d) for d in dicts), dtype=np.int64, count=n)
+    return (ts,) + tuple(
+        np.fromiter((float(d[field]) for d in dicts), dtype=np.float64, count=n)
+        for field in ('open', 'high', 'low', 'close')
+    )
 
 @dataclass
 class MarginZoneConfig:
@@ -63,52 +72,146 @@ class MarginZone:
     false_break_count: int = 0
     inside_bars: int = 0
 
-def calculate_atr(candles: List[Candle], period: int) -> Optional[float]:
-    """Расчёт ATR."""
-    if len(candles) < period + 1:
+def calculate_atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int) -> Optional[float]:
+    """Расчёт ATR (среднее TR за последние period баров) по массивам high/low/close."""
+    if len(close) < period + 1:
         return None
     
-    tr_sum = 0.0
-    for i in range(1, period + 1):
-        curr = candles[-i]
-        prev = candles[-i - 1]
-        tr = max(
-            curr.high - curr.low,
-            abs(curr.high - prev.close),
-            abs(curr.low - prev.close)
-        )
-        tr_sum += tr
-    
-    return tr_sum / period
+    h = high[-period:]
+    l = low[-period:]
+    prev_c = close[-period - 1:-1]
+    tr = np.maximum(np.maximum(h - l, np.abs(h - prev_c)), np.abs(l - prev_c))
+    return float(tr.mean())
+
+_IN_ZONE_STATES = (ZoneState.ENTERED, ZoneState.FALSE_BREAK, ZoneState.HOLD)
+
+def _transition(state: ZoneState, inside: bool, false_up: bool, false_dn: bool,
+                impulse: bool, hold: bool) -> Optional[ZoneState]:
+    """Эталонная лестница переходов (по ней один раз строится _TRANS)."""
+    if state == ZoneState.CREATED and inside:
+        return ZoneState.ENTERED
+    if state in _IN_ZONE_STATES:
+        if false_up or false_dn:
+            return ZoneState.FALSE_BREAK
+        if hold:
+            return ZoneState.HOLD
+    if impulse:
+        return ZoneState.EXIT_IMPULSE
+    return None
+
+# Таблица переходов: _TRANS[state.value, key] -> значение ZoneState события (0 — нет события),
+# key = inside | false_up<<1 | false_dn<<2 | impulse<<3 | hold<<4
+_TRANS = np.zeros((len(ZoneState) + 1, 32), dtype=np.int8)
+for _state in ZoneState:
+    for _key in range(32):
+        _event = _transition(_state, *(bool(_key >> bit & 1) for bit in range(5)))
+        _TRANS[_state.value, _key] = _event.value if _event else 0
+del _state, _key, _event
+_STATE_BY_VALUE = (None,) + tuple(ZoneState)
+
+def _true_range(high: float, low: float, prev_close: float) -> float:
+    """True Range одной свечи."""
+    return float(max(high - low, abs(high - prev_close), abs(low - prev_close)))
 
 class MarginZoneEngine:
     """Основной класс движка."""
     
+    _BODY_LOOKBACK = 20
+    
     def __init__(self, symbol: str, timeframe: str, config: Optional[MarginZoneConfig] = None):
         self.symbol = symbol
         self.timeframe = timeframe
         self.cfg = config or MarginZoneConfig()
         self.active_zone: Optional[MarginZone] = None
-        self.candle_history: List[Candle] = []
+        # История свечей в SoA-виде: буферы ts/open/high/low/close ёмкостью 2*_buf_cap,
+        # окно [_lo, _n) — последние не более _buf_cap свечей (self._ts и т.д. — его срезы)
+        self._buf_cap = max(self.cfg.atr_period + 2, 200)
+        self._buf = (np.zeros(2 * self._buf_cap, dtype=np.int64),) + tuple(
+            np.zeros(2 * self._buf_cap, dtype=np.float64) for _ in range(4)
+        )
+        self._lo = 0
+        self._n = 0
+        self._sync_views()
+        # ATR по Уайлдеру на последней закрытой свече (индекс -2)
+        self._atr: Optional[float] = None
+        self._atr_ts: int = 0
+        self._prev_close: float = 0.0
+        # Скользящая сумма тел последних _BODY_LOOKBACK свечей
+        self._body_window: deque = deque(maxlen=self._BODY_LOOKBACK)
+        self._body_sum: float = 0.0
         self.logger = logging.getLogger(f"MarginZone.{symbol}")
         
+    def _sync_views(self) -> None:
+        """Обновляет срезы окна истории."""
+        lo, hi = self._lo, self._n
+        self._ts, self._open, self._high, self._low, self._close = (a[lo:hi] for a in self._buf)
+        
     def update_candles(self, new_candles: List[Dict[str, Any]]) -> None:
-        """Загрузка свечей в движок."""
-        self.candle_history = [Candle.from_dict(c) for c in new_candles]
+        """Полная загрузка свечей в движок (хранятся последние _buf_cap)."""
+        arrays = _candles_from_dicts(new_candles[-self._buf_cap:])
+        m = len(arrays[0])
+        for buf, arr in zip(self._buf, arrays):
+            buf[:m] = arr
+        self._lo, self._n = 0, m
+        self._sync_views()
+        
+        self._body_window.clear()
+        self._body_window.extend(np.abs(self._close - self._open)[-self._BODY_LOOKBACK:].tolist())
+        self._body_sum = sum(self._body_window)
+        
+    def append_candle(self, new_candle: Dict[str, Any]) -> None:
+        """
+        Добавление одной свечи за O(1).
+        Свеча с тем же ts, что и последняя, заменяет её (формирующийся бар).
+        """
+        candle = _candle_from_dict(new_candle)
+        body = abs(candle.close - candle.open)
+        window = self._body_window
+        if self._n > self._lo and candle.ts and candle.ts == self._buf[0][self._n - 1]:
+            i = self._n - 1
+            self._body_sum += body - window[-1]
+            window[-1] = body
+        else:
+            if len(window) == window.maxlen:
+                self._body_sum -= window[0]
+            window.append(body)
+            self._body_sum += body
+            if self._n == len(self._buf[0]):
+                # Буфер кончился: переносим окно в начало (раз в _buf_cap свечей)
+                keep = self._n - self._lo
+                for buf in self._buf:
+                    buf[:keep] = buf[self._lo:self._n]
+                self._lo, self._n = 0, keep
+            i = self._n
+            self._n += 1
+            if self._n - self._lo > self._buf_cap:
+                self._lo += 1
+        
+        for buf, value in zip(self._buf, candle):
+            buf[i] = value
+        self._sync_views()
+        
+    def _candle(self, i: int) -> Candle:
+        """Свеча по индексу из SoA-массивов."""
+        return Candle(
+            int(self._ts[i]), float(self._open[i]), float(self._high[i]),
+            float(self._low[i]), float(self._close[i])
+        )
         
     def process(self) -> Optional[ZoneState]:
         """Основной метод обработки. Возвращает событие или None."""
-        if len(self.candle_history) < self.cfg.atr_period + 1:
+        cfg = self.cfg
+        if len(self._close) < cfg.atr_period + 1:
             return None
             
-        last_candle = self.candle_history[-1]
-        atr = calculate_atr(self.candle_history, self.cfg.atr_period)
+        last_candle = self._candle(-1)
+        atr = self._update_atr()
         if atr is None:
             return None
             
-        # Создание новой зоны при импульсе
+        # Создание новой зоны при импульсной свече
         if not self.active_zone:
-            if self._is_impulse(last_candle, atr):
+            if (last_candle.high - last_candle.low) >= atr * cfg.impulse_atr_mult:
                 self.active_zone = self._create_zone(last_candle, atr)
                 self.logger.info(f"Зона CREATED: {self.active_zone.upper:.2f}-{self.active_zone.lower:.2f}")
                 return ZoneState.CREATED
@@ -122,9 +225,27 @@ class MarginZoneEngine:
                 self.active_zone = None
         return event
         
-    def _is_impulse(self, candle: Candle, atr: float) -> bool:
-        """Детектор импульсной свечи."""
-        return (candle.high - candle.low) >= atr * self.cfg.impulse_atr_mult
+    def _update_atr(self) -> Optional[float]:
+        """
+        ATR с рекурсивным обновлением Уайлдера: atr_n = (atr_{n-1}*(p-1) + tr_n) / p.
+        Последняя свеча может ещё формироваться, поэтому состояние хранится на
+        предпоследней; полный пересчёт (seed) — только если история сдвинулась
+        больше чем на одну свечу или ts свечей неизвестны.
+        """
+        p = self.cfg.atr_period
+        h, l, c = self._high, self._low, self._close
+        if len(c) < p + 2:
+            return calculate_atr(h, l, c, p)
+        
+        prev_ts, prev2_ts = int(self._ts[-2]), int(self._ts[-3])
+        if self._atr is None or not prev_ts or self._atr_ts not in (prev_ts, prev2_ts):
+            self._atr = calculate_atr(h[:-1], l[:-1], c[:-1], p)
+        elif self._atr_ts == prev2_ts:
+            self._atr = (self._atr * (p - 1) + _true_range(h[-2], l[-2], self._prev_close)) / p
+        self._atr_ts = prev_ts
+        self._prev_close = float(c[-2])
+        
+        return (self._atr * (p - 1) + _true_range(h[-1], l[-1], c[-2])) / p
         
     def _create_zone(self, candle: Candle, atr: float) -> MarginZone:
         """Создание зоны от midpoint импульсной свечи."""
@@ -144,56 +265,44 @@ class MarginZoneEngine:
         
     def _process_zone(self, zone: MarginZone, candle: Candle, atr: float) -> Optional[ZoneState]:
         """Логика обработки состояния зоны."""
+        cfg = self.cfg
         # 1. Проверка срока жизни
-        if zone.inside_bars > self.cfg.max_zone_lifetime:
+        if zone.inside_bars > cfg.max_zone_lifetime:
             zone.state = ZoneState.EXPIRED
             return ZoneState.EXPIRED
             
-        # 2. Проверка входа в зону
-        inside = zone.lower <= candle.close <= zone.upper
-        if zone.state == ZoneState.CREATED and inside:
-            zone.state = ZoneState.ENTERED
-            zone.inside_bars = 1
-            return ZoneState.ENTERED
-            
-        # 3. Логика внутри зоны
-        if zone.state in (ZoneState.ENTERED, ZoneState.FALSE_BREAK, ZoneState.HOLD):
-            if inside:
-                zone.inside_bars += 1
-            else:
-                zone.inside_bars = 0
-                
-            # Ложный выход
-            false_up = candle.high > zone.upper and candle.close < zone.upper
-            false_dn = candle.low < zone.lower and candle.close > zone.lower
-            if false_up or false_dn:
-                zone.false_break_count += 1
-                zone.state = ZoneState.FALSE_BREAK
-                return ZoneState.FALSE_BREAK
-                
-            # Удержание
-            if zone.inside_bars >= self.cfg.hold_bars:
-                zone.state = ZoneState.HOLD
-                return ZoneState.HOLD
-                
-        # 4. Импульсный выход
+        # 2. Признаки бара -> индекс в таблице переходов
+        upper, lower = zone.upper, zone.lower
+        _, c_open, c_high, c_low, c_close = candle
+        inside = lower <= c_close <= upper
+        if zone.state in _IN_ZONE_STATES:
+            zone.inside_bars = (zone.inside_bars + 1) * inside
+        
+        false_up = c_high > upper and c_close < upper
+        false_dn = c_low < lower and c_close > lower
         avg_body = self._get_avg_body()
-        if avg_body:
-            body = abs(candle.close - candle.open)
-            impulse_up = candle.close > zone.upper and body >= avg_body * self.cfg.impulse_exit_body_mult
-            impulse_dn = candle.close < zone.lower and body >= avg_body * self.cfg.impulse_exit_body_mult
-            if impulse_up or impulse_dn:
-                zone.state = ZoneState.EXIT_IMPULSE
-                return ZoneState.EXIT_IMPULSE
+        impulse = bool(avg_body) and (
+            abs(c_close - c_open) >= avg_body * cfg.impulse_exit_body_mult
+            and (c_close > upper or c_close < lower)
+        )
+        hold = zone.inside_bars >= cfg.hold_bars
+        key = inside | (false_up << 1) | (false_dn << 2) | (impulse << 3) | (hold << 4)
         
-        return None
+        # 3. Переход по таблице
+        event = _STATE_BY_VALUE[_TRANS[zone.state.value, key]]
+        if event is ZoneState.ENTERED:
+            zone.inside_bars = 1
+        elif event is ZoneState.FALSE_BREAK:
+            zone.false_break_count += 1
+        if event:
+            zone.state = event
+        return event
         
-    def _get_avg_body(self, lookback: int = 20) -> Optional[float]:
-        """Средний размер тела свечи."""
-        if len(self.candle_history) < lookback:
+    def _get_avg_body(self) -> Optional[float]:
+        """Средний размер тела свечи за последние _BODY_LOOKBACK баров (O(1))."""
+        if len(self._body_window) < self._BODY_LOOKBACK:
             return None
-        bodies = [abs(c.close - c.open) for c in self.candle_history[-lookback:]]
-        return sum(bodies) / len(bodies)
+        return self._body_sum / self._BODY_LOOKBACK
         
     def get_zone_info(self) -> Optional[Dict[str, Any]]:
         """Информация о текущей зоне для логов."""
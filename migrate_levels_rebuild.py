@@ -20,6 +20,11 @@ con = sqlite3.connect(DB_PATH)
 con.isolation_level = None  # manual transaction
 cur = con.cursor()
 
+# --- bulk-режим: без журнала и fsync (бэкап уже есть), после COMMIT вернём WAL/NORMAL
+for p in ("journal_mode=OFF", "synchronous=OFF", "temp_store=MEMORY",
+          "cache_size=-200000", "locking_mode=EXCLUSIVE"):
+    cur.execute(f"PRAGMA {p}")
+
 def cols_of(table: str):
     return [(r[1], r[2], r[4], r[3]) for r in cur.execute(f"PRAGMA table_info({table})")]
     # returns list of (name, type, dflt_value, notnull)
@@ -77,8 +82,8 @@ FROM levels
 
 try:
     cur.execute("BEGIN IMMEDIATE")
-    # создаём новую таблицу
-    cur.executescript(DDL)
+    # создаём новую таблицу (execute, а не executescript: тот коммитит открытую транзакцию)
+    cur.execute(DDL)
     # заполняем её данными из старой
     cur.execute(f"""
         INSERT OR REPLACE INTO levels_new
@@ -89,12 +94,20 @@ try:
     cur.execute("DROP TABLE levels")
     cur.execute("ALTER TABLE levels_new RENAME TO levels")
     cur.execute("COMMIT")
+    cur.execute("PRAGMA locking_mode=NORMAL")
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
     print("✅ Migration OK: table 'levels' rebuilt with defaults.")
 except Exception as e:
-    cur.execute("ROLLBACK")
+    # без журнала ROLLBACK не гарантирует целостность — возвращаем файл из бэкапа
+    try:
+        cur.execute("ROLLBACK")
+    except sqlite3.Error:
+        pass
+    con.close()
+    shutil.copy2(bak, DB_PATH)
     print("ERROR:", e)
     print("Restored from backup:", bak)
-    con.close()
     sys.exit(4)
 
 con.close()
@@ -1,30 +1,42 @@
 # -*- coding: utf-8 -*-
-import os, csv, sqlite3, time
+import os, csv, sqlite3, time, asyncio
+from contextlib import closing
 from typing import List, Dict
 
+EXPORT_FETCH_SIZE = 1000
+
 def _connect(db_path: str = "bot.db") -> sqlite3.Connection:
-    return sqlite3.connect(db_path, timeout=30)
+    conn = sqlite3.connect(db_path, timeout=30)
+    # WAL: чтение для экспорта не блокирует запись бота
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
 
-async def export_csv(out_dir: str) -> str:
-    os.makedirs(out_dir, exist_ok=True)
-    path = os.path.join(out_dir, f"ml_export_{int(time.time())}.csv")
-    conn = _connect("bot.db")
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, symbol, tf, side, entry, stop, tp1, tp2, tp3,
-               qty, status, opened_at, closed_at, realized_pnl
-        FROM paper_trades
-        ORDER BY id DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
+def _export_csv_sync(path: str) -> None:
     header = [
         "id","symbol","tf","side","entry","stop",
         "tp1","tp2","tp3","qty","status",
         "opened_at","closed_at","realized_pnl"
     ]
-    with open(path, "w", newline="", encoding="utf-8") as f:
+    with closing(_connect("bot.db")) as conn, open(path, "w", newline="", encoding="utf-8") as f:
+        cur = conn.cursor()
+        cur.arraysize = EXPORT_FETCH_SIZE
+        cur.execute("""
+            SELECT id, symbol, tf, side, entry, stop, tp1, tp2, tp3,
+                   qty, status, opened_at, closed_at, realized_pnl
+            FROM paper_trades
+            ORDER BY id DESC
+        """)
         writer = csv.writer(f)
         writer.writerow(header)
-        writer.writerows(rows)
+        # Пачками по arraysize строк — память не зависит от размера таблицы
+        while True:
+            rows = cur.fetchmany()
+            if not rows:
+                break
+            writer.writerows(rows)
+
+async def export_csv(out_dir: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"ml_export_{int(time.time())}.csv")
+    await asyncio.to_thread(_export_csv_sync, path)
     return path
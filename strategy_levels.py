@@ -5,9 +5,11 @@
 # Ровный шаг по базовой свече (тело+тень в сторону движения).
 # Печати/тестовых блоков нет. Только функции для импорта.
 
-from typing import Dict, List, Optional, Union, Tuple
+from typing import Callable, Dict, List, Optional, Union, Tuple
 import numpy as np
 
+from _njit import njit, prange
+
 # -------------------- НОРМАЛИЗАЦИЯ --------------------
 
 def _norm(c: Dict) -> Dict[str, float]:
@@ -20,37 +22,91 @@ def _norm(c: Dict) -> Dict[str, float]:
         "close":float(c.get("close")or c.get("c") or 0.0),
     }
 
+_OHLC_DTYPE = np.dtype([("ts", "i8"), ("o", "f8"), ("h", "f8"), ("l", "f8"), ("c", "f8")])
+
+def _make_normalizer(sample: Dict) -> Callable[[Dict], Tuple[int, float, float, float, float]]:
+    """
+    Определяет схему ключей по одной свече пакета и возвращает нормализатор
+    свеча -> (ts, open, high, low, close) без перебора альтернативных ключей.
+    Нераспознанная схема идёт через _norm.
+    """
+    ts_key = "ts" if sample.get("ts") else "timestamp"
+    if "open" in sample and "close" in sample:
+        o, h, l, c = "open", "high", "low", "close"
+    elif "o" in sample and "c" in sample:
+        o, h, l, c = "o", "h", "l", "c"
+    else:
+        def norm_generic(x: Dict) -> Tuple[int, float, float, float, float]:
+            n = _norm(x)
+            return n["ts"], n["open"], n["high"], n["low"], n["close"]
+        return norm_generic
+    
+    def norm(x: Dict) -> Tuple[int, float, float, float, float]:
+        return (
+            int(x.get(ts_key) or 0),
+            float(x.get(o) or 0.0),
+            float(x.get(h) or 0.0),
+            float(x.get(l) or 0.0),
+            float(x.get(c) or 0.0),
+        )
+    return norm
+
+def _ohlc_records(candles: List[Dict]) -> np.ndarray:
+    """Свечи -> структурированный массив (ts, o, h, l, c) за один проход."""
+    if not candles:
+        return np.empty(0, dtype=_OHLC_DTYPE)
+    norm = _make_normalizer(candles[0])
+    return np.fromiter((norm(c) for c in candles), dtype=_OHLC_DTYPE, count=len(candles))
+
 def _is_green(c: Dict) -> bool:
-    """Зелёная, если close >= open."""
-    c = _norm(c)
+    """Зелёная, если close >= open (c — уже нормализованная свеча)."""
     return c["close"] >= c["open"]
 
-def _impulse_size(c: Dict) -> float:
+def _impulse_size_ohlc(o: float, h: float, l: float, c: float) -> float:
     """
     Импульс базовой: тело + тень В СТОРОНУ движения.
     - зелёная: high - open
     - красная: open - low
     """
-    c = _norm(c)
-    return (c["high"] - c["open"]) if _is_green(c) else (c["open"] - c["low"])
+    return (h - o) if c >= o else (o - l)
+
+def _impulse_size(c: Dict) -> float:
+    """Импульс для свечи-словаря (одна нормализация)."""
+    _, o, h, l, cl = _make_normalizer(c)(c)
+    return _impulse_size_ohlc(o, h, l, cl)
 
 # -------------------- ВЫБОР БАЗОВОЙ СВЕЧИ --------------------
 
-def pick_biggest_candle(candles: List[Dict]) -> Optional[Dict]:
+def _to_ohlc_arrays(candles: List[Dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Свечи -> массивы (open, high, low, close) за один проход."""
+    rec = _ohlc_records(candles)
+    return rec["o"], rec["h"], rec["l"], rec["c"]
+
+def pick_biggest_candle(
+    candles: List[Dict],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    ohlc: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+) -> Optional[Dict]:
     """
     Возвращает свечу с максимальным импульсом по правилу выше.
     Формат возвращаемой свечи: {ts, open, high, low, close} float (ts=int).
+
+    start/end — границы поиска как у среза candles[start:end], но без копии списка.
+    ohlc — уже готовые массивы (open, high, low, close) по всем candles, если есть у вызывающего.
     """
     if not candles:
         return None
-    best = None
-    best_sz = -1.0
-    for raw in candles:
-        sz = _impulse_size(raw)
-        if sz > best_sz:
-            best = raw
-            best_sz = sz
-    return _norm(best) if best else None
+    lo, hi, _ = slice(start, end).indices(len(candles))
+    if lo >= hi:
+        return None
+    
+    if ohlc is None:
+        o, h, l, c = _to_ohlc_arrays(candles[lo:hi])
+    else:
+        o, h, l, c = (a[lo:hi] for a in ohlc)
+    sizes = np.where(c >= o, h - o, o - l)
+    return _norm(candles[lo + int(sizes.argmax())])
 
 # -------------------- РАСЧЁТ УРОВНЕЙ --------------------
 
@@ -62,20 +118,14 @@ def calculate_levels_for_candle(base: Dict) -> Dict[str, float]:
     b = _norm(base)
     A = b["open"]
 
-    if _is_green(b):
-        C = b["high"]
-        d = C - A
-        F = A - d
-        D = C + d
-        X = F - d
-        Y = D + d
-    else:
-        C = b["low"]
-        d = A - C
-        F = A + d
-        D = C - d
-        X = F + d
-        Y = D - d
+    # Зелёная и красная отличаются только выбором C: шаг со знаком sd = s*d = C - A
+    # (s = +1 / -1), поэтому формулы уровней общие и без ветвлений
+    C = b["high"] if _is_green(b) else b["low"]
+    sd = C - A
+    F = A - sd
+    D = C + sd
+    X = F - sd
+    Y = D + sd
 
     f1 = 0.5 * (F + A)
     a1 = 0.5 * (A + C)
@@ -93,125 +143,243 @@ def calculate_levels_for_candle(base: Dict) -> Dict[str, float]:
     out["Y"]  = float(Y)
     return out
 
+# -------------------- УРОВНИ ПО ВСЕЙ ИСТОРИИ (БЭКТЕСТ) --------------------
+
+_LEVEL_NAMES = ("X", "F", "f1", "A", "a1", "C", "c1", "D", "Y")
+
+@njit(cache=True, parallel=True)
+def _levels_nb(o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray, lookback: int) -> np.ndarray:
+    """
+    Уровни (n, 9) в порядке _LEVEL_NAMES для каждого бара i.
+    lookback <= 0 — базовая свеча сам бар i; иначе — свеча с максимальным импульсом
+    среди последних lookback баров до i включительно (первая при равенстве).
+    """
+    n = o.shape[0]
+    out = np.empty((n, 9))
+    for i in prange(n):
+        j = i
+        if lookback > 0:
+            best = -np.inf
+            for k in range(max(0, i - lookback + 1), i + 1):
+                sz = (h[k] - o[k]) if c[k] >= o[k] else (o[k] - l[k])
+                if sz > best:
+                    best = sz
+                    j = k
+        
+        A = o[j]
+        C = h[j] if c[j] >= o[j] else l[j]
+        sd = C - A
+        F = A - sd
+        D = C + sd
+        out[i, 0] = F - sd
+        out[i, 1] = F
+        out[i, 2] = 0.5 * (F + A)
+        out[i, 3] = A
+        out[i, 4] = 0.5 * (A + C)
+        out[i, 5] = C
+        out[i, 6] = 0.5 * (C + D)
+        out[i, 7] = D
+        out[i, 8] = D + sd
+    return out
+
+def levels_series(
+    candles: Union[List[Dict], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+    lookback: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Уровни X..Y для каждого бара за один проход (режим бэктеста).
+    candles — список свечей или готовые массивы (open, high, low, close).
+    lookback=N даёт на баре i то же, что calculate_levels(candles[:i+1], use_biggest_from_last=N);
+    без lookback базовой считается сам бар.
+    """
+    if isinstance(candles, tuple):
+        o, h, l, c = (np.ascontiguousarray(a, dtype=np.float64) for a in candles)
+    else:
+        o, h, l, c = (np.ascontiguousarray(a) for a in _to_ohlc_arrays(candles))
+    
+    out = _levels_nb(o, h, l, c, lookback or 0)
+    return {name: out[:, k] for k, name in enumerate(_LEVEL_NAMES)}
+
 # -------------------- RSI РАСЧЁТ --------------------
 
-def calculate_rsi(candles: List[Dict], period: int = 14) -> Optional[float]:
+# Свечи-словари или уже готовый массив цен закрытия
+CandlesOrCloses = Union[List[Dict], np.ndarray]
+
+def _closes_array(candles: CandlesOrCloses) -> np.ndarray:
+    """
+    Цены закрытия одним float64-массивом: ключ close/c определяется один раз
+    по первой свече; готовый массив возвращается без копирования.
+    """
+    if isinstance(candles, np.ndarray):
+        return np.ascontiguousarray(candles, dtype=np.float64)
+    if not candles:
+        return np.empty(0, dtype=np.float64)
+    
+    sample = candles[0]
+    key = "close" if "close" in sample else "c" if "c" in sample else None
+    if key is None:
+        return np.fromiter((_norm(c)["close"] for c in candles), dtype=np.float64, count=len(candles))
+    return np.fromiter((float(c.get(key) or 0.0) for c in candles), dtype=np.float64, count=len(candles))
+
+@njit(cache=True)
+def _wilder_seed_nb(closes: np.ndarray, period: int) -> Tuple[float, float]:
+    """Стартовые средние gain/loss: простое среднее первых period изменений."""
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, period + 1):
+        change = closes[i] - closes[i - 1]
+        if change > 0:
+            avg_gain += change
+        else:
+            avg_loss -= change
+    return avg_gain / period, avg_loss / period
+
+@njit(cache=True)
+def wilder_step(avg_gain: float, avg_loss: float, change: float, period: int) -> Tuple[float, float]:
+    """Один шаг сглаживания Уайлдера для изменения цены change."""
+    gain = change if change > 0 else 0.0
+    loss = -change if change < 0 else 0.0
+    return (avg_gain * (period - 1) + gain) / period, (avg_loss * (period - 1) + loss) / period
+
+@njit(cache=True)
+def _wilder_averages_nb(closes: np.ndarray, period: int) -> Tuple[float, float]:
+    """Средние gain/loss по Уайлдеру на последнем баре (len(closes) >= period + 1)."""
+    avg_gain, avg_loss = _wilder_seed_nb(closes, period)
+    for i in range(period + 1, closes.shape[0]):
+        avg_gain, avg_loss = wilder_step(avg_gain, avg_loss, closes[i] - closes[i - 1], period)
+    return avg_gain, avg_loss
+
+@njit(cache=True)
+def _rsi_series_nb(closes: np.ndarray, period: int) -> np.ndarray:
+    """
+    RSI по Уайлдеру для каждого бара: первое значение — на индексе period
+    (простое среднее первых period изменений), дальше рекурсивное сглаживание.
+    Первые period значений = NaN.
+    """
+    n = closes.shape[0]
+    out = np.full(n, np.nan)
+    if n < period + 1:
+        return out
+    
+    avg_gain, avg_loss = _wilder_seed_nb(closes, period)
+    
+    for i in range(period, n):
+        if i > period:
+            avg_gain, avg_loss = wilder_step(avg_gain, avg_loss, closes[i] - closes[i - 1], period)
+        if avg_loss == 0:
+            out[i] = 100.0
+        else:
+            out[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return out
+
+def calculate_rsi(candles: CandlesOrCloses, period: int = 14) -> Optional[float]:
     """Вычисляет RSI(14) для последней свечи в массиве."""
     if len(candles) < period + 1:
         return None
     
-    closes = []
-    for c in candles:
-        norm_c = _norm(c)
-        closes.append(norm_c["close"])
-    
-    if len(closes) < period + 1:
+    return float(_rsi_series_nb(_closes_array(candles), period)[-1])
+
+def wilder_averages(candles: CandlesOrCloses, period: int = 14) -> Optional[Tuple[float, float]]:
+    """Средние gain/loss по Уайлдеру на последней свече — состояние RSI для дорасчёта."""
+    if len(candles) < period + 1:
         return None
     
-    gains, losses = [], []
-    for i in range(1, len(closes)):
-        change = closes[i] - closes[i - 1]
-        gains.append(max(change, 0.0))
-        losses.append(max(-change, 0.0))
-    
-    avg_gain = sum(gains[:period]) / period
-    avg_loss = sum(losses[:period]) / period
-    
-    for i in range(period, len(gains)):
-        avg_gain = (avg_gain * (period - 1) + gains[i]) / period
-        avg_loss = (avg_loss * (period - 1) + losses[i]) / period
-    
-    if avg_loss == 0:
-        return 100.0
-    
-    rs = avg_gain / avg_loss
-    return 100.0 - (100.0 / (1.0 + rs))
+    avg_gain, avg_loss = _wilder_averages_nb(_closes_array(candles), period)
+    return float(avg_gain), float(avg_loss)
 
-def rsi_series(candles: List[Dict], period: int = 14) -> List[Optional[float]]:
+def rsi_series(candles: CandlesOrCloses, period: int = 14) -> List[Optional[float]]:
     """Возвращает RSI для каждой позиции (первые period значений = None)."""
     if len(candles) < period + 1:
         return [None] * len(candles)
     
-    closes = []
-    for c in candles:
-        norm_c = _norm(c)
-        closes.append(norm_c["close"])
+    rsis = _rsi_series_nb(_closes_array(candles), period)
+    return [None if v != v else v for v in rsis.tolist()]
+
+# -------------------- EMA РАСЧЁТ (ИСПРАВЛЕННЫЙ) --------------------
+
+@njit(cache=True)
+def _ema_nb(closes: np.ndarray, period: int) -> np.ndarray:
+    """EMA по массиву закрытий: старт с SMA первых period значений, первые period-1 = NaN."""
+    n = closes.shape[0]
+    out = np.full(n, np.nan)
+    if n < period:
+        return out
     
-    rsis = [None] * period
-    for i in range(period, len(closes)):
-        gains, losses = [], []
-        for j in range(i - period + 1, i + 1):
-            change = closes[j] - closes[j - 1]
-            gains.append(max(change, 0.0))
-            losses.append(max(-change, 0.0))
-        
-        avg_gain = sum(gains) / period
-        avg_loss = sum(losses) / period
-        
-        if avg_loss == 0:
-            rsi = 100.0
-        else:
-            rs = avg_gain / avg_loss
-            rsi = 100.0 - (100.0 / (1.0 + rs))
-        rsis.append(rsi)
+    ema = 0.0
+    for i in range(period):
+        ema += closes[i]
+    ema /= period
+    out[period - 1] = ema
     
-    return rsis
+    k = 2.0 / (period + 1.0)
+    for i in range(period, n):
+        ema = closes[i] * k + ema * (1.0 - k)
+        out[i] = ema
+    return out
 
-# -------------------- EMA РАСЧЁТ (ИСПРАВЛЕННЫЙ) --------------------
+def _ema_list(closes: np.ndarray, period: int) -> List[Optional[float]]:
+    """Серия EMA в виде списка (NaN -> None)."""
+    return [None if v != v else v for v in _ema_nb(closes, period).tolist()]
 
-def calculate_ema_series(candles: List[Dict], period: int) -> List[Optional[float]]:
+def calculate_ema_series(candles: CandlesOrCloses, period: int) -> List[Optional[float]]:
     """Вычисляет EMA для каждого бара (по ценам закрытия)."""
     if len(candles) < period:
         return [None] * len(candles)
     
-    closes = []
-    for c in candles:
-        norm_c = _norm(c)
-        closes.append(norm_c["close"])
-    
-    # Рассчитываем EMA для каждого бара
-    emas = [None] * (period - 1)  # Первые period-1 значений = None
-    
-    # Начальное значение EMA - SMA
-    sma = sum(closes[:period]) / period
-    emas.append(sma)
-    
-    # Коэффициент сглаживания
-    k = 2.0 / (period + 1.0)
-    
-    # Вычисляем EMA для остальных баров
-    for i in range(period, len(closes)):
-        ema = (closes[i] * k) + (emas[-1] * (1 - k))
-        emas.append(ema)
-    
-    return emas
+    return _ema_list(_closes_array(candles), period)
 
-def calculate_ema(candles: List[Dict], period: int) -> Optional[float]:
+def calculate_ema(candles: CandlesOrCloses, period: int) -> Optional[float]:
     """Вычисляет EMA для последнего бара."""
-    emas = calculate_ema_series(candles, period)
-    return emas[-1] if emas else None
+    if len(candles) < period:
+        return None
+    
+    return float(_ema_nb(_closes_array(candles), period)[-1])
+
+_EMA_PERIODS = np.array([8, 54, 78, 200], dtype=np.int64)
+
+@njit(cache=True)
+def _all_emas_nb(closes: np.ndarray, periods: np.ndarray) -> np.ndarray:
+    """
+    Все EMA за один проход по закрытиям: массив (len(periods), n).
+    Каждая серия стартует с SMA своих первых period значений, до этого — NaN.
+    """
+    n = closes.shape[0]
+    m = periods.shape[0]
+    out = np.full((m, n), np.nan)
+    ema = np.zeros(m)
+    k = np.empty(m)
+    for j in range(m):
+        k[j] = 2.0 / (periods[j] + 1.0)
+    
+    for i in range(n):
+        c = closes[i]
+        for j in range(m):
+            p = periods[j]
+            if i < p - 1:
+                ema[j] += c
+            elif i == p - 1:
+                ema[j] = (ema[j] + c) / p
+                out[j, i] = ema[j]
+            else:
+                ema[j] = c * k[j] + ema[j] * (1.0 - k[j])
+                out[j, i] = ema[j]
+    return out
 
-def calculate_all_emas(candles: List[Dict]) -> Dict[str, Optional[float]]:
+def calculate_all_emas(candles: CandlesOrCloses) -> Dict[str, Optional[float]]:
     """Вычисляет EMA-8, EMA-54, EMA-78, EMA-200 для последнего бара."""
-    periods = [8, 54, 78, 200]
-    result = {}
-    
-    for period in periods:
-        ema_value = calculate_ema(candles, period)
-        result[f"EMA_{period}"] = ema_value
+    if len(candles) == 0:
+        return {f"EMA_{p}": None for p in _EMA_PERIODS.tolist()}
     
-    return result
+    last = _all_emas_nb(_closes_array(candles), _EMA_PERIODS)[:, -1].tolist()
+    return {f"EMA_{p}": (None if v != v else v) for p, v in zip(_EMA_PERIODS.tolist(), last)}
 
-def get_all_ema_series(candles: List[Dict]) -> Dict[str, List[Optional[float]]]:
+def get_all_ema_series(candles: CandlesOrCloses) -> Dict[str, List[Optional[float]]]:
     """Возвращает серии EMA для всех периодов."""
-    periods = [8, 54, 78, 200]
-    result = {}
-    
-    for period in periods:
-        ema_series = calculate_ema_series(candles, period)
-        result[f"EMA_{period}"] = ema_series
-    
-    return result
+    emas = _all_emas_nb(_closes_array(candles), _EMA_PERIODS)
+    return {
+        f"EMA_{p}": [None if v != v else v for v in row]
+        for p, row in zip(_EMA_PERIODS.tolist(), emas.tolist())
+    }
 
 def ema_trend_analysis(emas: Dict[str, Optional[float]], current_price: float) -> Dict[str, any]:
     """Анализ тренда на основе EMA."""
@@ -289,26 +457,28 @@ def ema_trend_analysis(emas: Dict[str, Optional[float]], current_price: float) -
 
 # -------------------- ПАТТЕРНЫ --------------------
 
+@njit(cache=True)
+def _find_engulfing(o: np.ndarray, c: np.ndarray) -> int:
+    """Первое поглощение в окне: +1 бычье, -1 медвежье, 0 нет."""
+    for i in range(1, o.shape[0]):
+        po, pc = o[i - 1], c[i - 1]
+        co, cc = o[i], c[i]
+        if pc < po and cc > co and co <= pc and cc >= po:
+            return 1
+        if pc > po and cc < co and co >= pc and cc <= po:
+            return -1
+    return 0
+
+_ENGULFING_NAMES = {1: "🟢 Бычье поглощение", -1: "🔴 Медвежье поглощение"}
+
 def detect_patterns(candles: List[Dict], lookback: int = 96) -> List[str]:
     """Обнаруживает паттерны engulfing."""
-    out: List[str] = []
     if len(candles) < 2:
-        return out
+        return []
     
-    rng = candles[-min(lookback, len(candles)):]
-    for i in range(1, len(rng)):
-        p, c = rng[i - 1], rng[i]
-        po, pc = float(p.get("open", 0)), float(p.get("close", 0))
-        co, cc = float(c.get("open", 0)), float(c.get("close", 0))
-        
-        if pc < po and cc > co and co <= pc and cc >= po:
-            out.append("🟢 Бычье поглощение")
-            break
-        if pc > po and cc < co and co >= pc and cc <= po:
-            out.append("🔴 Медвежье поглощение")
-            break
-    
-    return out
+    o, _, _, c = _to_ohlc_arrays(candles[-min(lookback, len(candles)):])
+    found = _find_engulfing(o, c)
+    return [_ENGULFING_NAMES[found]] if found else []
 
 # -------------------- ОСНОВНАЯ ФУНКЦИЯ --------------------
 
@@ -330,11 +500,11 @@ def calculate_levels(
     if not candles:
         return {}
 
-    src = candles
+    start = None
     if isinstance(use_biggest_from_last, int) and use_biggest_from_last > 0:
-        src = candles[-use_biggest_from_last:]
+        start = -use_biggest_from_last
 
-    base = pick_biggest_candle(src)
+    base = pick_biggest_candle(candles, start)
     if not base:
         return {}
 
@@ -348,14 +518,38 @@ def calculate_levels(
     levels["_base_close"] = base["close"]
     
     return levels
+# -------------------- AOT-ЯДРА --------------------
+
+# JIT-ядра и их сигнатуры для AOT-сборки (build_numba_aot.py)
+_JIT_KERNELS = {
+    "rsi_series": (_rsi_series_nb, "f8[:](f8[:], i8)"),
+    "ema_series": (_ema_nb, "f8[:](f8[:], i8)"),
+    "all_emas": (_all_emas_nb, "f8[:,:](f8[:], i8[:])"),
+    "find_engulfing": (_find_engulfing, "i8(f8[:], f8[:])"),
+}
+
+# Собранный модуль cryptolite_kernels подменяет JIT-ядра: без компиляции при старте бота
+try:
+    from cryptolite_kernels import (
+        rsi_series as _rsi_series_nb,
+        ema_series as _ema_nb,
+        all_emas as _all_emas_nb,
+        find_engulfing as _find_engulfing,
+    )
+except ImportError:
+    pass
+
 # -------------------- EXPORT --------------------
 
 __all__ = [
     "pick_biggest_candle",
     "calculate_levels_for_candle",
     "calculate_levels",
+    "levels_series",
     "calculate_rsi",
     "rsi_series",
+    "wilder_averages",
+    "wilder_step",
     "detect_patterns",
     "calculate_ema",
     "calculate_ema_series",
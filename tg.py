@@ -5,11 +5,50 @@ TG - Модуль для отправки структурированных о
 
 import asyncio
 import aiohttp
+import atexit
+import hashlib
+import math
+import mimetypes
 import os
-from typing import Optional, Dict, List, Tuple, Any
+import random
+import time
+from collections import OrderedDict
+from functools import partial
+from operator import itemgetter
+from typing import Optional, Dict, List, Set, Tuple, Any, Callable, Awaitable, BinaryIO, Union
 import logging
 from datetime import datetime
 
+import numpy as np
+
+# Быстрая (де)сериализация JSON, если установлен orjson
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    
+    _json_loads = json.loads
+
+# HTTP/2 для коротких запросов (sendMessage и т.п.), если установлен httpx с пакетом h2:
+# параллельные отправки мультиплексируются в одном TLS-соединении
+try:
+    import httpx
+    import h2  # noqa: F401 — нужен httpx для http2=True
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    httpx = None
+    _HTTP2_AVAILABLE = False
+
+# Ошибки соединения, после которых запрос имеет смысл повторить
+_TRANSIENT_ERRORS: Tuple[type, ...] = (aiohttp.ClientError, asyncio.TimeoutError)
+if httpx is not None:
+    _TRANSIENT_ERRORS += (httpx.TransportError,)
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -19,14 +58,260 @@ logger = logging.getLogger(__name__)
 
 # Константы Telegram API
 TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/{method}"
+# Общий лимит Bot API ~30 сообщений/с: 25/с с всплеском 5 не превышают его ни в одном окне
+TG_SEND_RATE = 25.0
+TG_SEND_BURST = 5
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _env_int_clamped(name: str, default: int, lo: int, hi: int) -> int:
+    """Целое из переменной окружения, ограниченное [lo, hi]; мусор/inf/nan -> default."""
+    try:
+        value = float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(value):
+        return default
+    return int(min(max(value, lo), hi))
+
+# Размеры пулов: короткие запросы (sendMessage) и загрузки файлов (sendPhoto) раздельно,
+# чтобы медленная загрузка графика не занимала соединения для оповещений
+TG_POOL_TEXT = _env_int_clamped("TG_POOL_TEXT", 32, 1, 100)
+TG_POOL_UPLOAD = _env_int_clamped("TG_POOL_UPLOAD", 4, 1, 32)
+TG_PHOTO_MAX_BYTES = 10 * 1024 * 1024  # лимит Bot API для sendPhoto
+
+# Повторы запроса: 429 — после retry_after, 5xx и сетевые ошибки — экспоненциально,
+# к паузе добавляется случайная добавка, чтобы повторы не приходили разом
+TG_MAX_ATTEMPTS = 3
+TG_BACKOFF_CAP = 8.0
+
+# Склейка сообщений: окно ожидания, порог немедленной отправки и жёсткий лимит Telegram
+TG_BATCH_WINDOW = 0.3
+TG_BATCH_FLUSH_CHARS = 3500
+TG_MESSAGE_MAX_CHARS = 4096
+_BATCH_SEPARATOR = "\n──────────\n"
+
+# Content-Type фото по расширению файла; mimetypes опрашивается один раз на расширение
+_CTYPE_CACHE: Dict[str, str] = {}
+
+def _photo_content_type(filename: str) -> str:
+    """MIME-тип изображения по имени файла (image/png, если определить не удалось)."""
+    ext = os.path.splitext(filename)[1].lower()
+    ctype = _CTYPE_CACHE.get(ext)
+    if ctype is None:
+        ctype = _CTYPE_CACHE[ext] = mimetypes.guess_type(filename)[0] or "image/png"
+    return ctype
+
+class TelegramSender:
+    """
+    Очередь исходящих запросов бота с двумя полосами: текст и загрузки файлов.
+    У каждой полосы своя очередь и воркер. Воркер ждёт свободный слот полосы
+    (не больше TG_POOL_TEXT / TG_POOL_UPLOAD запросов одновременно — по размеру пулов),
+    окончания flood-wait (429 retry_after) бота и токена из общей корзины
+    (TG_SEND_RATE в секунду, всплеск до TG_SEND_BURST), затем запускает отправку
+    отдельной задачей и сразу берёт следующую: запросы идут параллельно, а медленная
+    загрузка графика не задерживает текстовые оповещения.
+    Воркеры и примитивы синхронизации создаются при первой отправке в текущем
+    event loop — в __init__ loop может ещё не работать.
+    """
+    
+    def __init__(self, bot: "TelegramBot", rate: float = TG_SEND_RATE, burst: int = TG_SEND_BURST):
+        self.bot = bot
+        self.rate = rate
+        self.burst = float(burst)
+        # upload -> (очередь, слоты полосы, воркер)
+        self._lanes: Dict[bool, Tuple[asyncio.Queue, asyncio.Semaphore, asyncio.Task]] = {}
+        self._inflight: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bucket_lock: Optional[asyncio.Lock] = None
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+    
+    def _lane_queue(self, upload: bool) -> asyncio.Queue:
+        """Очередь полосы; при первом обращении (или в новом event loop) запускает её воркер."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lanes = {}
+            self._inflight = set()
+            self._bucket_lock = asyncio.Lock()
+            self._loop = loop
+        
+        lane = self._lanes.get(upload)
+        if lane is None or lane[2].done():
+            queue: asyncio.Queue = asyncio.Queue()
+            slots = asyncio.Semaphore(TG_POOL_UPLOAD if upload else TG_POOL_TEXT)
+            lane = self._lanes[upload] = (queue, slots, asyncio.create_task(self._run(queue, slots)))
+        return lane[0]
+    
+    async def enqueue(self, send: Callable[[], Awaitable[bool]], upload: bool = False) -> bool:
+        """
+        Ставит отправку в очередь и ждёт её результата. send — фабрика корутины,
+        upload=True — загрузка файла (своя полоса и свой лимит одновременных запросов).
+        """
+        queue = self._lane_queue(upload)
+        fut = asyncio.get_running_loop().create_future()
+        await queue.put((send, fut))
+        return await fut
+    
+    async def _take_token(self) -> None:
+        """Забирает токен из общей корзины, при пустой корзине ждёт его пополнения."""
+        async with self._bucket_lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens < 1.0:
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+                self._tokens, self._last_refill = 1.0, time.monotonic()
+            self._tokens -= 1.0
+    
+    async def _wait_flood(self) -> None:
+        """Ждёт окончания flood-wait, если он активен."""
+        delay = self.bot.flood_wait_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def _run(self, queue: asyncio.Queue, slots: asyncio.Semaphore) -> None:
+        while True:
+            send, fut = await queue.get()
+            try:
+                await slots.acquire()
+                try:
+                    await self._wait_flood()
+                    await self._take_token()
+                except BaseException:
+                    slots.release()
+                    raise
+                task = asyncio.create_task(self._deliver(send, fut, slots))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            finally:
+                queue.task_done()
+    
+    async def _deliver(self, send: Callable[[], Awaitable[bool]], fut: asyncio.Future, slots: asyncio.Semaphore) -> None:
+        """Выполняет одну отправку и передаёт результат ожидающему enqueue."""
+        try:
+            # Повторы на 429/5xx делает сам _make_request
+            result = await send()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(result)
+        finally:
+            slots.release()
+    
+    async def close(self) -> None:
+        """Останавливает воркеры; ещё не отправленные запросы отменяются."""
+        tasks = list(self._inflight)
+        for queue, _, worker in self._lanes.values():
+            worker.cancel()
+            tasks.append(worker)
+            while not queue.empty():
+                _, fut = queue.get_nowait()
+                fut.cancel()
+        for task in self._inflight:
+            task.cancel()
+        self._lanes = {}
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 class TelegramBot:
     """Класс для работы с Telegram Bot API."""
     
+    # Общие HTTP-сессии всех экземпляров: пулы keep-alive соединений к api.telegram.org
+    _text_session: Optional[aiohttp.ClientSession] = None
+    _upload_session: Optional[aiohttp.ClientSession] = None
+    _http2_client: Optional["httpx.AsyncClient"] = None
+    _session_loop: Optional[asyncio.AbstractEventLoop] = None
+    # Lock привязывается к event loop, поэтому создаётся лениво — свой для каждого loop
+    _session_lock: Optional[asyncio.Lock] = None
+    _session_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    @classmethod
+    def _get_session_lock(cls, loop: asyncio.AbstractEventLoop) -> asyncio.Lock:
+        """Lock создания сессий для текущего event loop."""
+        if cls._session_lock is None or cls._session_lock_loop is not loop:
+            cls._session_lock = asyncio.Lock()
+            cls._session_lock_loop = loop
+        return cls._session_lock
+    
+    @classmethod
+    async def get_session(cls, upload: bool = False) -> aiohttp.ClientSession:
+        """
+        Возвращает общую сессию (создаёт при первом обращении или в новом event loop):
+        upload=False — пул для коротких запросов, upload=True — пул для загрузки файлов.
+        """
+        loop = asyncio.get_running_loop()
+        attr = "_upload_session" if upload else "_text_session"
+        session = getattr(cls, attr)
+        if session is not None and not session.closed and cls._session_loop is loop:
+            return session
+        
+        async with cls._get_session_lock(loop):
+            if cls._session_loop is not loop:
+                cls._text_session = cls._upload_session = cls._http2_client = None
+                cls._session_loop = loop
+            session = getattr(cls, attr)
+            if session is None or session.closed:
+                limit = TG_POOL_UPLOAD if upload else TG_POOL_TEXT
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=limit, limit_per_host=limit, keepalive_timeout=75, ttl_dns_cache=300
+                    ),
+                    timeout=aiohttp.ClientTimeout(total=60 if upload else 30),
+                )
+                setattr(cls, attr, session)
+        return session
+    
+    @classmethod
+    async def get_http2_client(cls) -> "httpx.AsyncClient":
+        """Общий HTTP/2-клиент httpx для коротких запросов (только при _HTTP2_AVAILABLE)."""
+        loop = asyncio.get_running_loop()
+        client = cls._http2_client
+        if client is not None and not client.is_closed and cls._session_loop is loop:
+            return client
+        
+        async with cls._get_session_lock(loop):
+            if cls._session_loop is not loop:
+                cls._text_session = cls._upload_session = cls._http2_client = None
+                cls._session_loop = loop
+            client = cls._http2_client
+            if client is None or client.is_closed:
+                client = cls._http2_client = httpx.AsyncClient(
+                    http2=True,
+                    timeout=30,
+                    limits=httpx.Limits(
+                        max_connections=TG_POOL_TEXT,
+                        max_keepalive_connections=TG_POOL_TEXT,
+                        keepalive_expiry=75,
+                    ),
+                )
+        return client
+    
+    @classmethod
+    async def close_session(cls) -> None:
+        """Закрывает общие сессии (при остановке бота)."""
+        for session in (cls._text_session, cls._upload_session):
+            if session is not None and not session.closed:
+                await session.close()
+        if cls._http2_client is not None and not cls._http2_client.is_closed:
+            await cls._http2_client.aclose()
+        cls._text_session = cls._upload_session = cls._http2_client = None
+        cls._session_loop = None
+    
     def __init__(self, token: Optional[str] = None, chat_id: Optional[str] = None):
         self.token = token or os.getenv("TELEGRAM_BOT_TOKEN", "")
         self.chat_id = chat_id or os.getenv("TELEGRAM_CHAT_ID", "")
-        self.session = None
+        self.flood_wait_until = 0.0  # time.monotonic(), до которого Telegram просит не слать
+        self.sender = TelegramSender(self)
+        # Незакрытые пачки send_message_batched: ключ -> {parts, size, fut, timer, kwargs}
+        self._batches: Dict[Tuple, Dict[str, Any]] = {}
         
         if not self.token:
             logger.warning("TELEGRAM_BOT_TOKEN не установлен")
@@ -34,36 +319,96 @@ class TelegramBot:
             logger.warning("TELEGRAM_CHAT_ID не установлен")
     
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        # Сессия общая для модуля и закрывается через close_session()
+        pass
     
-    async def _make_request(self, method: str, params: Optional[Dict] = None) -> Optional[Dict]:
-        """Базовый метод для запросов к Telegram API."""
+    async def _post(
+        self,
+        url: str,
+        payload: Optional[bytes],
+        make_form: Optional[Callable[[], Awaitable[aiohttp.FormData]]]
+    ) -> Tuple[int, bytes]:
+        """
+        Один POST к Bot API, возвращает (HTTP-статус, тело ответа).
+        JSON-запросы идут через HTTP/2-клиент, если он доступен; multipart-загрузки
+        (и JSON без httpx) — через пулы aiohttp.
+        """
+        if make_form is None and _HTTP2_AVAILABLE:
+            client = await self.get_http2_client()
+            response = await client.post(url, content=payload, headers=_JSON_HEADERS)
+            return response.status_code, response.content
+        
+        if make_form is not None:
+            post_kwargs = {"data": await make_form()}
+        else:
+            post_kwargs = {"data": payload, "headers": _JSON_HEADERS}
+        session = await self.get_session(upload=make_form is not None)
+        async with session.post(url, **post_kwargs) as response:
+            return response.status, await response.read()
+    
+    async def _make_request(
+        self,
+        method: str,
+        params: Optional[Dict] = None,
+        make_form: Optional[Callable[[], Awaitable[aiohttp.FormData]]] = None
+    ) -> Optional[Dict]:
+        """
+        Базовый метод для запросов к Telegram API: JSON из params или multipart.
+        make_form строит FormData заново для каждой попытки — отправленную форму
+        aiohttp повторно использовать не даёт.
+        До TG_MAX_ATTEMPTS попыток: на 429 ждёт retry_after, на 5xx и сетевых
+        ошибках — экспоненциальную паузу со случайной добавкой.
+        """
         if not self.token:
             logger.error("Токен бота не установлен")
             return None
         
         url = TELEGRAM_API_URL.format(token=self.token, method=method)
+        payload = _json_dumps(params) if make_form is None else None
         
-        try:
-            async with self.session.post(url, json=params) as response:
-                if response.status != 200:
-                    logger.error(f"HTTP ошибка: {response.status}")
+        for attempt in range(TG_MAX_ATTEMPTS):
+            last = attempt == TG_MAX_ATTEMPTS - 1
+            try:
+                status, raw = await self._post(url, payload, make_form)
+                if status == 429:
+                    body = _json_loads(raw)
+                    retry_after = float((body.get("parameters") or {}).get("retry_after", 1))
+                    self.flood_wait_until = time.monotonic() + retry_after
+                    logger.warning(f"Flood limit Telegram, пауза {retry_after:.0f} с")
+                    if last:
+                        return None
+                    await asyncio.sleep(retry_after + random.uniform(0, 0.25))
+                    continue
+                
+                if status >= 500 and not last:
+                    logger.warning(f"HTTP ошибка: {status}, повтор {attempt + 1}/{TG_MAX_ATTEMPTS - 1}")
+                    await asyncio.sleep(min(2 ** attempt, TG_BACKOFF_CAP) + random.uniform(0, 0.5))
+                    continue
+                
+                if status != 200:
+                    logger.error(f"HTTP ошибка: {status}")
                     return None
                 
-                data = await response.json()
+                data = _json_loads(raw)
                 if not data.get("ok"):
                     logger.error(f"Telegram API error: {data.get('description')}")
                     return None
                 
                 return data.get("result")
-        except Exception as e:
-            logger.error(f"Ошибка при запросе к Telegram API: {e}")
-            return None
+            except _TRANSIENT_ERRORS as e:
+                if last:
+                    logger.error(f"Ошибка при запросе к Telegram API: {e}")
+                    return None
+                logger.warning(f"Сетевая ошибка Telegram API: {e}, повтор {attempt + 1}/{TG_MAX_ATTEMPTS - 1}")
+                await asyncio.sleep(min(2 ** attempt, TG_BACKOFF_CAP) + random.uniform(0, 0.5))
+            except Exception as e:
+                logger.error(f"Ошибка при запросе к Telegram API: {e}")
+                return None
+        
+        return None
     
     async def send_message(
         self,
@@ -94,80 +439,281 @@ class TelegramBot:
             logger.error(f"Не удалось отправить сообщение в чат {self.chat_id}")
         
         return success
+    
+    async def send_message_queued(self, text: str, **kwargs: Any) -> bool:
+        """send_message через очередь бота (с лимитом скорости)."""
+        return await self.sender.enqueue(partial(self.send_message, text, **kwargs))
+    
+    async def send_message_batched(self, text: str, key: Optional[str] = None, **kwargs: Any) -> bool:
+        """
+        Склеивает сообщения одного ключа (по умолчанию chat_id), пришедшие за TG_BATCH_WINDOW,
+        в одно через _BATCH_SEPARATOR. Пачка уходит сразу, если длиннее TG_BATCH_FLUSH_CHARS;
+        если новый текст не влезает в лимит Telegram, сначала отправляется накопленное.
+        Возвращает результат отправки пачки, в которую попал text.
+        """
+        batch_key = (key or str(self.chat_id), tuple(sorted(kwargs.items())))
+        batch = self._batches.get(batch_key)
+        if batch is not None and batch["size"] + len(_BATCH_SEPARATOR) + len(text) > TG_MESSAGE_MAX_CHARS:
+            self._flush_batch(batch_key)
+            batch = None
+        
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = {"parts": [], "size": -len(_BATCH_SEPARATOR), "fut": loop.create_future(), "kwargs": kwargs}
+            batch["timer"] = loop.call_later(TG_BATCH_WINDOW, self._flush_batch, batch_key)
+            self._batches[batch_key] = batch
+        
+        batch["parts"].append(text)
+        batch["size"] += len(_BATCH_SEPARATOR) + len(text)
+        fut = batch["fut"]
+        if batch["size"] > TG_BATCH_FLUSH_CHARS:
+            self._flush_batch(batch_key)
+        return await asyncio.shield(fut)
+    
+    def _flush_batch(self, batch_key: Tuple) -> None:
+        """Отправляет накопленную пачку через очередь и передаёт результат ожидающим."""
+        batch = self._batches.pop(batch_key, None)
+        if batch is None:
+            return
+        batch["timer"].cancel()
+        fut = batch["fut"]
+        task = asyncio.ensure_future(
+            self.send_message_queued(_BATCH_SEPARATOR.join(batch["parts"]), **batch["kwargs"])
+        )
+        
+        def _done(t: asyncio.Task) -> None:
+            if fut.done():
+                return
+            if t.cancelled():
+                fut.cancel()
+            elif t.exception() is not None:
+                fut.set_exception(t.exception())
+            else:
+                fut.set_result(t.result())
+        
+        task.add_done_callback(_done)
+    
+    async def send_photo(self, photo_path: str, caption: str = "") -> bool:
+        """Отправка изображения с диска в чат, указанный в chat_id."""
+        # Дисковые операции — в пуле потоков, чтобы не блокировать event loop;
+        # один stat отвечает и на «есть ли файл», и на размер
+        try:
+            st = await asyncio.to_thread(os.stat, photo_path)
+        except OSError:
+            logger.error(f"Файл не найден: {photo_path}")
+            return False
+        if not 0 < st.st_size <= TG_PHOTO_MAX_BYTES:
+            logger.error(f"Недопустимый размер файла {photo_path}: {st.st_size} байт")
+            return False
+        
+        return await self._send_photo(photo_path, caption, os.path.basename(photo_path))
+    
+    async def send_photo_bytes(self, photo_bytes: bytes, caption: str = "", filename: str = "chart.png") -> bool:
+        """Отправка изображения из памяти в чат, указанный в chat_id (тип — по расширению filename)."""
+        return await self._send_photo(photo_bytes, caption, filename)
+    
+    async def _send_photo(self, photo: Union[bytes, str], caption: str, filename: str) -> bool:
+        """sendPhoto multipart-запросом; photo — байты или путь к файлу на диске."""
+        if not self.chat_id:
+            logger.error("Chat ID не установлен")
+            return False
+        
+        content_type = _photo_content_type(filename)
+        opened: List[BinaryIO] = []
+        
+        async def make_form() -> aiohttp.FormData:
+            form = aiohttp.FormData()
+            form.add_field("chat_id", str(self.chat_id))
+            form.add_field("caption", caption)
+            if isinstance(photo, bytes):
+                form.add_field("photo", photo, filename=filename, content_type=content_type)
+            else:
+                # Файл отдаётся aiohttp как поток: читается чанками прямо в сокет, без копии
+                # в памяти. aiohttp закрывает его после отправки, поэтому на каждую попытку
+                # файл открывается заново
+                f = await asyncio.to_thread(open, photo, 'rb')
+                opened.append(f)
+                form.add_field("photo", f, filename=filename, content_type=content_type)
+            return form
+        
+        try:
+            result = await self._make_request("sendPhoto", make_form=make_form)
+        finally:
+            for f in opened:
+                f.close()
+        success = result is not None
+        
+        if success:
+            logger.info(f"Фото {filename} отправлено в чат {self.chat_id}")
+        else:
+            logger.error(f"Не удалось отправить фото {filename} в чат {self.chat_id}")
+        
+        return success
+
+async def close_session() -> None:
+    """Закрывает общую HTTP-сессию Telegram (вызывать при остановке бота)."""
+    await TelegramBot.close_session()
+
+@atexit.register
+def _close_session_at_exit() -> None:
+    """Страховка на выход: закрываем сессию, если её loop ещё можно запустить."""
+    loop = TelegramBot._session_loop
+    sessions = (TelegramBot._text_session, TelegramBot._upload_session)
+    client = TelegramBot._http2_client
+    if loop is None or (
+        all(s is None or s.closed for s in sessions) and (client is None or client.is_closed)
+    ):
+        return
+    if loop.is_closed() or loop.is_running():
+        return
+    try:
+        loop.run_until_complete(TelegramBot.close_session())
+    except Exception:
+        pass
+
+def _now_hms() -> str:
+    """Текущее время 'HH:MM:SS' для подписи отчётов."""
+    return datetime.now().strftime('%H:%M:%S')
+
+# Бот для функций-отчётов: один на модуль, создаётся при первой отправке
+_report_bot: Optional[TelegramBot] = None
+
+def _get_report_bot() -> TelegramBot:
+    global _report_bot
+    if _report_bot is None:
+        _report_bot = TelegramBot()
+    return _report_bot
 
 # ============================================================================
 # ОСНОВНЫЕ ФУНКЦИИ ДЛЯ ОТПРАВКИ ОПОВЕЩЕНИЙ (ИМПОРТИРУЮТСЯ В MAIN)
 # ============================================================================
-async def send_levels_report(symbol: str, tf: str, levels: List[float], current_price: float) -> bool:
+
+# Шаблоны отчётов: неизменный текст собран один раз, в вызовах подставляются только поля.
+# Строки, формируемые в циклах, заданы заранее связанными методами str.format
+_REPORT_RULE = "──────────────────────"
+_F3 = "{:.3f}".format
+
+_LEVELS_HEADER = (
+    "📊 *Уровни {symbol} | {tf}*\n"
+    + _REPORT_RULE + "\n"
+    "💰 Текущая цена: `{price:.2f}`\n"
+    "\n"
+    "⬇️ *Уровни поддержки:*"
+)
+_FMT_SUPPORT_ITEM = "• `{:.2f}` (-{:.2f}%)".format
+_LEVELS_RESISTANCE_HEADER = "\n⬆️ *Уровни сопротивления:*"
+_FMT_RESISTANCE_ITEM = "• `{:.2f}` (+{:.2f}%)".format
+_LEVELS_FOOTER = "\n" + _REPORT_RULE + "\n📈 Всего уровней: {count}\n⏰ {ts}"
+
+_ZONES_HEADER = (
+    "🎯 *Маржинальные зоны {symbol} | {tf}*\n"
+    + _REPORT_RULE + "\n"
+    "💰 Текущая цена: `{price:.2f}`\n"
+    "\n"
+    "📏 *Обнаруженные зоны ликвидности:*"
+)
+_FMT_ZONE_ITEM = (
+    "\n"
+    "{i}. *Диапазон:* `{low:.2f}` - `{high:.2f}`\n"
+    "   *Средняя:* `{mid:.2f}`\n"
+    "   *Ширина:* {width:.2f}%\n"
+    "   *Положение:* {position}"
+).format
+_ZONES_FOOTER = "\n" + _REPORT_RULE + "\n📊 Всего зон: {count}\n⏰ {ts}"
+
+# Подавление повторных оповещений о совпадении: ключ -> время последней отправки (monotonic)
+COLLISION_ALERT_TTL = 300.0
+COLLISION_ALERT_CACHE_SIZE = 512
+_alert_seen: "OrderedDict[Tuple, float]" = OrderedDict()
+
+_COLLISION_TMPL = """
+⚠️ *СОВПАДЕНИЕ! {symbol} | {tf}*
+""" + _REPORT_RULE + """
+🎯 Уровень `{level:.2f}` находится в зоне маржинальных требований!
+
+📏 *Детали зоны:*
+• Нижняя граница: `{low:.2f}`
+• Верхняя граница: `{high:.2f}`
+• Ширина: {width:.2f}%
+
+📊 *Характеристика совпадения:*
+• Уровень {position}
+• Расстояние до ближайшей границы: {nearest:.2f}
+• Текущая цена: `{price:.2f}`
+
+💡 *Интерпретация:*
+Это зона повышенного интереса, где могут активироваться крупные ордера.
+Совпадение с техническим уровнем усиливает её значимость.
+
+""" + _REPORT_RULE + """
+⏰ {ts}
+    """
+async def send_levels_report(
+    symbol: str,
+    tf: str,
+    levels: List[float],
+    current_price: float,
+    ts: Optional[str] = None
+) -> bool:
     """
     Отправляет отчёт о рассчитанных уровнях для заданного символа и таймфрейма.
     Используется для MTF и STF.
+    ts — время отчёта 'HH:MM:SS' (пачка отчётов передаёт одно значение), по умолчанию сейчас.
     """
     if not levels:
         return True  # Нет уровней - не отправляем пустое сообщение
     
-    # Сортируем уровни для удобства чтения
-    sorted_levels = sorted(levels)
-    
-    # Формируем списки поддержки и сопротивления относительно текущей цены
-    support_levels = [lvl for lvl in sorted_levels if lvl < current_price]
-    resistance_levels = [lvl for lvl in sorted_levels if lvl > current_price]
+    # Сортируем уровни в numpy и делим по текущей цене бинарным поиском:
+    # ближайшие 5 поддержек и 5 сопротивлений (уровни, равные цене, не входят ни в одну группу)
+    arr = np.sort(np.asarray(levels, dtype=np.float64))
+    below = int(np.searchsorted(arr, current_price, side="left"))
+    above = int(np.searchsorted(arr, current_price, side="right"))
+    support = arr[max(0, below - 5):below]
+    resistance = arr[above:above + 5]
+    # Отклонения от цены в процентах — одной векторной операцией на группу
+    support_pct = (current_price - support) / current_price * 100.0
+    resistance_pct = (resistance - current_price) / current_price * 100.0
     
-    # Создаём текст сообщения
-    message = f"""
-📊 *Уровни {symbol} | {tf}*
-──────────────────────
-💰 Текущая цена: `{current_price:.2f}`
-
-⬇️ *Уровни поддержки:*
-"""
+    # Собираем текст сообщения по строкам
+    parts = [_LEVELS_HEADER.format(symbol=symbol, tf=tf, price=current_price)]
     
     # Добавляем уровни поддержки (сверху вниз - от ближнего к дальнему)
-    for level in reversed(support_levels[-5:]):  # Последние 5 уровней поддержки
-        diff_percent = ((current_price - level) / current_price) * 100
-        message += f"• `{level:.2f}` (-{diff_percent:.2f}%)\n"
+    parts.extend(map(_FMT_SUPPORT_ITEM, support[::-1].tolist(), support_pct[::-1].tolist()))
     
-    message += "\n⬆️ *Уровни сопротивления:*\n"
+    parts.append(_LEVELS_RESISTANCE_HEADER)
     
     # Добавляем уровни сопротивления (снизу вверх - от ближнего к дальнему)
-    for level in resistance_levels[:5]:  # Первые 5 уровней сопротивления
-        diff_percent = ((level - current_price) / current_price) * 100
-        message += f"• `{level:.2f}` (+{diff_percent:.2f}%)\n"
-    
-    message += f"""
-──────────────────────
-📈 Всего уровней: {len(levels)}
-⏰ {datetime.now().strftime('%H:%M:%S')}
-    """
+    parts.extend(map(_FMT_RESISTANCE_ITEM, resistance.tolist(), resistance_pct.tolist()))
+    
+    parts.append(_LEVELS_FOOTER.format(count=len(levels), ts=ts or _now_hms()))
     
     # Отправляем сообщение
-    async with TelegramBot() as bot:
-        return await bot.send_message(message)
+    return await _get_report_bot().send_message_batched("\n".join(parts))
 
-async def send_margin_zones_report(symbol: str, tf: str, zones: List[Dict[str, float]], current_price: float) -> bool:
+async def send_margin_zones_report(
+    symbol: str,
+    tf: str,
+    zones: List[Dict[str, float]],
+    current_price: float,
+    ts: Optional[str] = None
+) -> bool:
     """
     Отправляет отчёт о маржинальных зонах для заданного символа и таймфрейма.
     Используется ТОЛЬКО для STF (1h, 4h).
+    ts — время отчёта 'HH:MM:SS', по умолчанию сейчас.
     """
     if not zones:
         return True  # Нет зон - не отправляем пустое сообщение
     
-    # Сортируем зоны по средней точке для удобства чтения
-    sorted_zones = sorted(zones, key=lambda z: (z['high'] + z['low']) / 2)
+    # Границы и середина каждой зоны считаются один раз и служат и ключом сортировки,
+    # и данными для текста (зоны идут по средней точке для удобства чтения)
+    enriched = [(z['low'], z['high'], (z['low'] + z['high']) * 0.5) for z in zones]
+    enriched.sort(key=itemgetter(2))
     
-    # Формируем текст сообщения
-    message = f"""
-🎯 *Маржинальные зоны {symbol} | {tf}*
-──────────────────────
-💰 Текущая цена: `{current_price:.2f}`
-
-📏 *Обнаруженные зоны ликвидности:*
-"""
+    # Собираем текст сообщения по строкам
+    parts = [_ZONES_HEADER.format(symbol=symbol, tf=tf, price=current_price)]
     
-    for i, zone in enumerate(sorted_zones, 1):
-        zone_low = zone['low']
-        zone_high = zone['high']
-        zone_mid = (zone_low + zone_high) / 2
+    for i, (zone_low, zone_high, zone_mid) in enumerate(enriched, 1):
         zone_width_percent = ((zone_high - zone_low) / zone_mid) * 100
         
         # Определяем положение зоны относительно текущей цены
@@ -178,99 +724,123 @@ async def send_margin_zones_report(symbol: str, tf: str, zones: List[Dict[str, f
         else:
             position = "🟡 Цена ВНУТРИ зоны!"
         
-        message += f"""
-{i}. *Диапазон:* `{zone_low:.2f}` - `{zone_high:.2f}`
-   *Средняя:* `{zone_mid:.2f}`
-   *Ширина:* {zone_width_percent:.2f}%
-   *Положение:* {position}
-"""
+        parts.append(_FMT_ZONE_ITEM(
+            i=i, low=zone_low, high=zone_high, mid=zone_mid,
+            width=zone_width_percent, position=position
+        ))
     
-    message += f"""
-──────────────────────
-📊 Всего зон: {len(zones)}
-⏰ {datetime.now().strftime('%H:%M:%S')}
-    """
+    parts.append(_ZONES_FOOTER.format(count=len(zones), ts=ts or _now_hms()))
     
     # Отправляем сообщение
-    async with TelegramBot() as bot:
-        return await bot.send_message(message)
+    return await _get_report_bot().send_message_batched("\n".join(parts))
 
 async def send_collision_alert(
     symbol: str, 
     tf: str, 
     level: float, 
     zone: Dict[str, float], 
-    current_price: float
+    current_price: float,
+    ts: Optional[str] = None
 ) -> bool:
     """
     Отправляет СПЕЦИАЛЬНОЕ оповещение о совпадении уровня и маржинальной зоны.
     Используется ТОЛЬКО для STF (1h, 4h) при обнаружении совпадения.
+    ts — время отчёта 'HH:MM:SS', по умолчанию сейчас.
+    То же совпадение (символ, ТФ, уровень, границы зоны) повторно не отправляется
+    в течение COLLISION_ALERT_TTL секунд.
     """
     zone_low = zone['low']
     zone_high = zone['high']
     
-    # Вычисляем, насколько уровень близок к границам зоны
-    if level < zone_low:
-        distance_to_zone = zone_low - level
-        distance_percent = (distance_to_zone / level) * 100
-        position = f"ниже нижней границы на {distance_percent:.3f}%"
-    elif level > zone_high:
-        distance_to_zone = level - zone_high
-        distance_percent = (distance_to_zone / level) * 100
-        position = f"выше верхней границы на {distance_percent:.3f}%"
+    alert_key = (symbol, tf, round(level, 2), round(zone_low, 2), round(zone_high, 2))
+    now = time.monotonic()
+    seen_at = _alert_seen.get(alert_key)
+    if seen_at is not None and now - seen_at < COLLISION_ALERT_TTL:
+        return True
+    _alert_seen[alert_key] = now
+    _alert_seen.move_to_end(alert_key)
+    if len(_alert_seen) > COLLISION_ALERT_CACHE_SIZE:
+        _alert_seen.popitem(last=False)
+    
+    # Расстояния до обеих границ считаются один раз: отрицательное — уровень вне зоны
+    # с этой стороны, минимум из двух — выход за ближайшую границу (или запас внутри)
+    d_low = level - zone_low
+    d_high = zone_high - level
+    outside = min(d_low, d_high)
+    if outside < 0:
+        side = "ниже нижней" if d_low < 0 else "выше верхней"
+        position = f"{side} границы на {_F3(-outside / level * 100)}%"
     else:
-        distance_to_center = abs(level - (zone_low + zone_high) / 2)
-        distance_percent = (distance_to_center / level) * 100
-        position = f"внутри зоны (от центра {distance_percent:.3f}%)"
+        position = f"внутри зоны (от центра {_F3(abs(d_low - d_high) / 2 / level * 100)}%)"
+    nearest_edge = min(abs(d_low), abs(d_high))
     
     # Формируем текст сообщения с ЖЁЛТЫМ ТРЕУГОЛЬНИКОМ в начале
-    message = f"""
-⚠️ *СОВПАДЕНИЕ! {symbol} | {tf}*
-──────────────────────
-🎯 Уровень `{level:.2f}` находится в зоне маржинальных требований!
+    message = _COLLISION_TMPL.format(
+        symbol=symbol, tf=tf, level=level, low=zone_low, high=zone_high,
+        width=(zone_high - zone_low) / zone_low * 100, position=position,
+        nearest=nearest_edge, price=current_price, ts=ts or _now_hms()
+    )
+    
+    # Отправляем сообщение
+    ok = await _get_report_bot().send_message_batched(message, disable_notification=False)  # Уведомление включено!
+    if not ok:
+        # Неудачная отправка не должна глушить повтор этого оповещения
+        _alert_seen.pop(alert_key, None)
+    return ok
 
-📏 *Детали зоны:*
-• Нижняя граница: `{zone_low:.2f}`
-• Верхняя граница: `{zone_high:.2f}`
-• Ширина: {((zone_high - zone_low) / zone_low * 100):.2f}%
+# Отметка последней успешной проверки связи: "<unix ts> <хэш токена и чата>"
+TG_PROBE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "crypto_lite", "tg_probe_ts")
+TG_PROBE_TTL = 3600.0
 
-📊 *Характеристика совпадения:*
-• Уровень {position}
-• Расстояние до ближайшей границы: {min(abs(level-zone_low), abs(level-zone_high)):.2f}
-• Текущая цена: `{current_price:.2f}`
+def _probe_fingerprint(bot: TelegramBot) -> str:
+    """Короткий хэш токена и chat_id — смена любого из них сбрасывает кэш проверки."""
+    return hashlib.sha256(f"{bot.token}:{bot.chat_id}".encode()).hexdigest()[:16]
 
-💡 *Интерпретация:*
-Это зона повышенного интереса, где могут активироваться крупные ордера.
-Совпадение с техническим уровнем усиливает её значимость.
+def _read_probe_ts(fingerprint: str) -> float:
+    """Время последней успешной проверки для этого бота (0, если нет или кэш чужой)."""
+    try:
+        with open(TG_PROBE_CACHE_PATH, encoding="utf-8") as f:
+            ts, cached_fp = f.read().split()
+        return float(ts) if cached_fp == fingerprint else 0.0
+    except (OSError, ValueError):
+        return 0.0
 
-──────────────────────
-⏰ {datetime.now().strftime('%H:%M:%S')}
-    """
-    
-    # Отправляем сообщение
-    async with TelegramBot() as bot:
-        return await bot.send_message(message, disable_notification=False)  # Уведомление включено!
+def _write_probe_ts(fingerprint: str) -> None:
+    try:
+        os.makedirs(os.path.dirname(TG_PROBE_CACHE_PATH), exist_ok=True)
+        with open(TG_PROBE_CACHE_PATH, "w", encoding="utf-8") as f:
+            f.write(f"{time.time():.0f} {fingerprint}")
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить отметку проверки Telegram: {e}")
 
 async def test_bot_connection() -> bool:
     """
     Тестирование подключения к боту.
+    Если проверка с тем же токеном и чатом прошла меньше TG_PROBE_TTL секунд назад,
+    тестовое сообщение не отправляется.
     """
-    async with TelegramBot() as bot:
-        # Вместо getMe просто пытаемся отправить тестовое сообщение
-        test_params = {
-            "chat_id": bot.chat_id,
-            "text": "🤖 Бот подключен и готов к работе!",
-            "parse_mode": "Markdown"
-        }
-        
-        result = await bot._make_request("sendMessage", test_params)
-        
-        if result:
-            logger.info("✅ Тест подключения к Telegram пройден успешно")
-            return True
-        else:
-            logger.error("❌ Не удалось подключиться к Telegram боту")
-            return False
+    bot = _get_report_bot()
+    fingerprint = _probe_fingerprint(bot)
+    if time.time() - await asyncio.to_thread(_read_probe_ts, fingerprint) < TG_PROBE_TTL:
+        logger.info("✅ Подключение к Telegram проверялось недавно, тест пропущен")
+        return True
+    
+    # Вместо getMe просто пытаемся отправить тестовое сообщение
+    test_params = {
+        "chat_id": bot.chat_id,
+        "text": "🤖 Бот подключен и готов к работе!",
+        "parse_mode": "Markdown"
+    }
+    
+    result = await bot._make_request("sendMessage", test_params)
+    
+    if result:
+        logger.info("✅ Тест подключения к Telegram пройден успешно")
+        await asyncio.to_thread(_write_probe_ts, fingerprint)
+        return True
+    else:
+        logger.error("❌ Не удалось подключиться к Telegram боту")
+        return False
 
 # ============================================================================
 # ТЕСТИРОВАНИЕ МОДУЛЯ
@@ -284,6 +854,7 @@ async def test_all_reports():
         return
     
     # Тестовые данные
+    ts = _now_hms()
     symbol = "BTCUSDT"
     tf = "1h"
     current_price = 45000.0
@@ -293,16 +864,20 @@ async def test_all_reports():
         {'high': 45300.0, 'low': 45200.0, 'width': 100.0, 'strength': 0.9}
     ]
     
-    print("1. Тест отчёта об уровнях...")
-    await send_levels_report(symbol, tf, test_levels, current_price)
-    
-    print("2. Тест отчёта о маржинальных зонах...")
-    await send_margin_zones_report(symbol, tf, test_zones, current_price)
-    
-    print("3. Тест оповещения о совпадении...")
-    await send_collision_alert(symbol, tf, 44950.0, test_zones[0], current_price)
+    # Отчёты независимы — отправляются одновременно (темп задаёт очередь бота)
+    print("Тест отчётов: уровни, маржинальные зоны, совпадение...")
+    results = await asyncio.gather(
+        send_levels_report(symbol, tf, test_levels, current_price, ts),
+        send_margin_zones_report(symbol, tf, test_zones, current_price, ts),
+        send_collision_alert(symbol, tf, 44950.0, test_zones[0], current_price, ts),
+        return_exceptions=True
+    )
+    for name, result in zip(("уровни", "маржинальные зоны", "совпадение"), results):
+        print(f"  {name}: {'✅' if result is True else f'❌ {result}'}")
     
     print("✅ Тестирование завершено")
+    await _get_report_bot().sender.close()
+    await close_session()
 
 if __name__ == "__main__":
     asyncio.run(test_all_reports())
\ No newline at end of file